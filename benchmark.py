@@ -0,0 +1,164 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import time
+import tracemalloc
+
+import pandas as pd
+from mip import MAXIMIZE, BINARY
+from model_builder import model_builder, block_registry
+from solver_backend import solver_backend
+from tag_index import tag_index
+from dominance import prune_recipes
+from model_setup import model_owner
+from synthetic_db import instance
+
+#constraint methods of the model classes and the attributes they are called with, timed in this order
+#a model class is only asked for the methods it has
+CONSTRAINT_STEPS = (('constraint_1', ('repetition_interval',)),
+                    ('constraint_2', ('n_assigned',)),
+                    ('constraint_3', ('target_calorie',)),
+                    ('constraint_4', ('target_protein',)),
+                    ('constraint_5', ('target_fat',)),
+                    ('constraint_6', ('target_rating',)),
+                    ('constraint_6_robust', ('target_rating', 'r')),
+                    ('constraint_6_profit', ('profit',)),
+                    ('constraint_7', ()),
+                    ('constraint_8', ()),
+                    ('constraint_9', ('target_tags',)))
+
+
+def git_version():
+    try:
+        return(subprocess.run(['git', 'describe', '--always', '--dirty'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None)
+    except OSError:
+        return(None)
+
+
+def measure(owner, name, step, memory=True):
+    #runs step() once and returns its wall time, peak traced python memory and what it added to owner.mipmodel
+    mipmodel = getattr(owner, 'mipmodel', None)
+    before = (0, 0, 0) if mipmodel is None else (mipmodel.num_rows, mipmodel.num_cols, mipmodel.num_nz)
+    if memory:
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    step()
+    seconds = time.perf_counter() - start
+    result = {'step': name, 'seconds': seconds}
+    if memory:
+        result['peak_bytes'] = tracemalloc.get_traced_memory()[1] - baseline
+    mipmodel = getattr(owner, 'mipmodel', None)
+    if mipmodel is not None:
+        result['rows'] = mipmodel.num_rows - before[0]
+        result['cols'] = mipmodel.num_cols - before[1]
+        result['nonzeros'] = mipmodel.num_nz - before[2]
+    return(result)
+
+
+def benchmark_model(model_name, data_path, solver_name='CBC', memory=True, **parameters):
+    #times every step of building the model of model_name on the recipes in data_path, one record per step
+    owner = model_owner(model_name, data_path, parameters)
+    robust = hasattr(owner, 'constraint_6_robust')
+
+    def create_model():
+        owner.mipmodel = solver_backend(solver_name).model(MAXIMIZE)
+        owner.blocks = block_registry(owner.mipmodel)
+
+    def create_builder():
+        owner.period_list = owner.expansion.period_list
+        owner.builder = model_builder(owner.expansion, owner.n_assigned, owner.tags)
+
+    steps = [('tag_index', lambda: setattr(owner, 'tags', tag_index(owner.recipes_df, owner.tag_matching, owner.tag_tokens)))]
+    if getattr(owner, 'prune_dominated', False):
+        def prune():
+            owner.recipes_df, owner.pruning = prune_recipes(owner.recipes_df, owner.n_assigned, owner.target_tags, owner.repetition_interval, owner.tags)
+            owner.tags = owner.tags.subset(owner.recipes_df['ix'].to_numpy())
+        steps.append(('prune_dominated', prune))
+    steps.append(('prepare_df', lambda: setattr(owner, 'expansion', owner.prepare_df(owner.recipes_df, owner.period_number))))
+    if hasattr(owner, 'robust_variables'):
+        steps.append(('robust_variables', lambda: owner.robust_variables(owner.recipes_df, 1, owner.deviation_percentage)))
+    steps += [('model_builder', create_builder),
+              ('model', create_model),
+              ('variables_xij', lambda: setattr(owner, 'xij', owner.builder.add_variables(owner.mipmodel, 'x', BINARY)))]
+    if robust:
+        def create_robust_variables():
+            owner.zij, owner.wj = owner.builder.add_robust_variables(owner.mipmodel, owner.robust_formulation)
+        steps.append(('variables_zij_wj', create_robust_variables))
+    steps.append(('objective', lambda: setattr(owner.mipmodel, 'objective', owner.builder.objective(owner.xij, 'profit'))))
+    for name, arguments in CONSTRAINT_STEPS:
+        if hasattr(owner, name):
+            method = getattr(owner, name)
+            steps.append((name, lambda method=method, arguments=arguments: method(*(getattr(owner, argument) for argument in arguments))))
+
+    if memory:
+        tracemalloc.start()
+    try:
+        records = [measure(owner, name, step, memory) for name, step in steps]
+    finally:
+        if memory:
+            tracemalloc.stop()
+    summary = {'model': model_name, 'data_path': data_path, 'n_recipes': len(owner.recipes_df),
+               'period_number': owner.period_number, 'solver': solver_name,
+               'seconds': sum(record['seconds'] for record in records),
+               'rows': owner.mipmodel.num_rows, 'cols': owner.mipmodel.num_cols, 'nonzeros': owner.mipmodel.num_nz,
+               'removed_pairs': owner.expansion.n_removed,
+               'steps': records}
+    return(summary)
+
+
+def run_benchmarks(model_name, sizes, period_numbers, solver_name='CBC', memory=True, seed=0,
+                   data_path='cleaned_db.csv', synthetic_directory='synthetic', **parameters):
+    #benchmarks every (size, period_number) pair, size None means the recipes in data_path
+    #other sizes are synthetic tables generated from data_path (see synthetic_db.py)
+    runs = []
+    for n_recipes in sizes:
+        for period_number in period_numbers:
+            if n_recipes is None:
+                path = data_path
+            else:
+                path = instance(n_recipes, period_number, seed, data_path, synthetic_directory)['data_path']
+            summary = benchmark_model(model_name, path, solver_name, memory, period_number=period_number, **parameters)
+            print('{} recipes x {} periods: {:.2f} s, {} rows, {} nonzeros'.format(
+                summary['n_recipes'], period_number, summary['seconds'], summary['rows'], summary['nonzeros']))
+            runs.append(summary)
+    return({'version': git_version(), 'python': platform.python_version(), 'created': time.time(),
+            'memory_traced': memory, 'runs': runs})
+
+
+def compare(old, new):
+    #step times of two benchmark results side by side, runs are matched by model, recipes and periods
+    def keyed(result):
+        return({(run['model'], run['n_recipes'], run['period_number'], record['step']): record
+                for run in result['runs'] for record in run['steps']})
+    old_records = keyed(old)
+    rows = []
+    for key, record in keyed(new).items():
+        if key in old_records:
+            rows.append(list(key) + [old_records[key]['seconds'], record['seconds'],
+                                     record['seconds'] / max(old_records[key]['seconds'], 1e-9)])
+    return(pd.DataFrame(rows, columns=['model', 'n_recipes', 'period_number', 'step', 'old_seconds', 'new_seconds', 'ratio']))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='model build benchmark per constraint family')
+    parser.add_argument('model', nargs='?', default='model_4')
+    parser.add_argument('--sizes', type=int, nargs='*', default=[], help='synthetic table sizes, the source table is always included')
+    parser.add_argument('--periods', type=int, nargs='+', default=[12])
+    parser.add_argument('--solver', default='CBC')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--data', default='cleaned_db.csv')
+    parser.add_argument('--no-memory', action='store_true', help='skip tracemalloc, which slows python allocations down')
+    parser.add_argument('--output', default='benchmark.json')
+    parser.add_argument('--compare', help='earlier benchmark json to compare the step times with')
+    args = parser.parse_args()
+    result = run_benchmarks(args.model, [None] + args.sizes, args.periods, args.solver, not args.no_memory,
+                            args.seed, args.data)
+    with open(args.output, 'w') as file:
+        json.dump(result, file, indent=1)
+    if args.compare:
+        with open(args.compare) as file:
+            print(compare(json.load(file), result).to_string(index=False))
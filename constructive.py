@@ -0,0 +1,214 @@
+import numpy as np
+import scipy.sparse as sp
+from lagrangian import column_periods, split_by_period
+
+
+class constructive_heuristic():
+    #fills the periods one after the other with n_assigned recipes: greedy by objective under the '<' rows
+    #(tag caps, see fill), then swaps recipes until the '>' rows (nutrients, rating) hold and, last, while the objective improves
+    #the repair aims margin (relative) above the '>' rows, single swaps get stuck just below rows that are all tight
+    #blocks: per period rows over xij, '=' 0 rows forbid their columns (seasonal rows); constraint_1 is handled here
+    #by leaving out the recipes kept in the previous repetition_interval periods, constraint_2 by the fill itself
+    #robust_rating: optional (target_rating, r), the Γ-robust rating row of every period with its exact worst case
+    def __init__(self, builder, blocks, objective, repetition_interval, robust_rating=None, max_swaps=200, margin=0.01,
+                 pressure=0.1, tolerance=1e-6):
+        self.builder = builder
+        self.n_assigned = builder.n_assigned
+        self.repetition_interval = repetition_interval
+        self.max_swaps = max_swaps
+        self.margin = margin
+        self.pressure = pressure
+        self.tolerance = tolerance
+        self.objective = np.asarray(objective, dtype=float)
+        self.robust_rating = robust_rating
+        if robust_rating is not None:
+            self.rating = builder.values('rating')
+            self.dijmax = builder.values('dijmax')
+        self.columns, self.pieces = split_by_period(blocks, column_periods(builder), builder.n_periods)
+
+    def period_rows(self, period_pos):
+        #(forbidden local columns, '>' matrix and rhs, '<' matrix and rhs) of one period, matrices over its columns
+        n_cols = len(self.columns[period_pos])
+        forbidden = np.zeros(n_cols, dtype=bool)
+        greater = ([], [])
+        less = ([], [])
+        for block in self.pieces[period_pos]:
+            if block.sense == '=':
+                if (block.rhs != 0).any():
+                    raise ValueError('{} has equality rows the heuristic cannot keep'.format(block.name))
+                forbidden[block.matrix.indices] = True
+            elif block.sense == '>':
+                greater[0].append(block.matrix)
+                greater[1].append(block.rhs)
+            else:
+                less[0].append(block.matrix)
+                less[1].append(block.rhs)
+
+        def stacked(matrices, rhs):
+            if not matrices:
+                return(sp.csr_matrix((0, n_cols)), np.zeros(0))
+            return(sp.vstack(matrices).tocsr(), np.concatenate(rhs))
+        return((forbidden,) + stacked(*greater) + stacked(*less))
+
+    def fits(self, less_t, slack, candidates):
+        #candidates whose '<' coefficients fit into slack, less_t is the transposed '<' matrix (column x row)
+        if less_t.shape[1] == 0:
+            return(np.ones(len(candidates), dtype=bool))
+        rows = less_t[candidates]
+        excess = np.full(len(candidates), -np.inf)
+        filled = np.flatnonzero(np.diff(rows.indptr))
+        if len(filled):
+            overshoot = rows.data - slack[rows.indices]
+            excess[filled] = np.maximum.reduceat(overshoot, rows.indptr[filled])
+        return(excess <= self.tolerance)
+
+    def fill(self, objective, allowed, less_t, less_rhs, pressure):
+        #n_assigned columns under the '<' rows, one at a time by objective rank minus pressure times how full
+        #the rows of the column get; without pressure the recipes with many common tags fill the caps early
+        rank = np.argsort(np.argsort(objective, kind='stable'), kind='stable') / max(len(objective), 1)
+        candidates = np.flatnonzero(allowed)
+        load = np.zeros(len(less_rhs))
+        selected = []
+        while len(selected) < self.n_assigned:
+            candidates = candidates[self.fits(less_t, less_rhs - load, candidates)]
+            if not len(candidates):
+                return(None)
+            score = rank[candidates]
+            if pressure and len(less_rhs):
+                score = score - pressure * (less_t[candidates] @ ((load + 1) / np.maximum(less_rhs, 1)))
+            position = np.argmax(score)
+            col = candidates[position]
+            selected.append(col)
+            load[less_t[col].indices] += less_t[col].data
+            candidates = np.delete(candidates, position)
+        return(np.array(selected))
+
+    def fill_period(self, period_pos, blocked):
+        #local columns of a feasible selection for one period, None when the swaps cannot repair it
+        forbidden, greater, greater_rhs, less, less_rhs = self.period_rows(period_pos)
+        cols = self.columns[period_pos]
+        objective = self.objective[cols]
+        allowed = ~forbidden & ~blocked[self.builder.recipe_pos[cols]]
+        less_t = less.T.tocsr()
+        greater = greater.toarray()
+        if self.robust_rating is not None:
+            target_rating, r = self.robust_rating
+            r = int(r)
+            rating = self.rating[cols]
+            deviation = self.dijmax[cols]
+            greater_rhs = np.append(greater_rhs, self.n_assigned * target_rating)
+
+        def levels(selected):
+            #left hand sides of the '>' rows, the robust row last
+            level = greater[:, selected].sum(axis=1)
+            if self.robust_rating is not None:
+                worst = np.sort(deviation[selected])[::-1][:r].sum()
+                level = np.append(level, rating[selected].sum() - worst)
+            return(level)
+
+        def swapped(selected, position, candidates):
+            #levels after selected[position] is swapped for each of the candidates, one column per candidate
+            out = selected[position]
+            after = greater[:, selected].sum(axis=1)[:, None] + greater[:, candidates] - greater[:, [out]]
+            if self.robust_rating is not None:
+                #the r largest deviations of the rest plus a candidate: the rest's r largest or its r - 1 largest and the candidate's
+                rest = np.delete(selected, position)
+                ordered = np.sort(deviation[rest])[::-1]
+                if r >= 1:
+                    worst = np.maximum(ordered[:r].sum(), ordered[:r - 1].sum() + deviation[candidates])
+                else:
+                    worst = np.zeros(len(candidates))
+                after = np.vstack([after, rating[rest].sum() + rating[candidates] - worst])
+            return(after)
+
+        scale = np.maximum(np.abs(greater_rhs), 1.0)
+        aim = greater_rhs + self.margin * scale
+        selected = None
+        for pressure in self.pressure * 2.0 ** np.arange(4):
+            selected = self.fill(objective, allowed, less_t, less_rhs, pressure)
+            if selected is not None:
+                break
+        if selected is None:
+            return(None)
+        load = less_t[selected].sum(axis=0).A1 if len(less_rhs) else np.zeros(0)
+        #best swaps: first the scaled shortfall of the '>' rows, then the objective
+        for swap in range(self.max_swaps):
+            level = levels(selected)
+            repair = (level < greater_rhs - self.tolerance).any()
+            target = aim if repair else greater_rhs
+            shortfall = np.maximum(target - level, 0) / scale
+            candidates = np.flatnonzero(allowed)
+            candidates = candidates[~np.isin(candidates, selected)]
+            best = None
+            for position, out in enumerate(selected):
+                row = less_t[out]
+                slack = less_rhs - load
+                slack[row.indices] += row.data
+                feasible = candidates[self.fits(less_t, slack, candidates)]
+                if not len(feasible):
+                    continue
+                after = swapped(selected, position, feasible)
+                new_shortfall = (np.maximum(target[:, None] - after, 0) / scale[:, None]).sum(axis=0)
+                gain = objective[feasible] - objective[out]
+                if repair:
+                    #repair: least shortfall, ties broken by the objective
+                    order = np.lexsort((-gain, new_shortfall))
+                    key = (new_shortfall[order[0]], -gain[order[0]])
+                    improves = key[0] < shortfall.sum() - self.tolerance
+                else:
+                    #improve: best objective among the swaps that keep the '>' rows
+                    keeps = np.flatnonzero(new_shortfall <= self.tolerance)
+                    if not len(keeps):
+                        continue
+                    order = keeps[np.argsort(-gain[keeps], kind='stable')]
+                    key = (0.0, -gain[order[0]])
+                    improves = gain[order[0]] > self.tolerance
+                if improves and (best is None or key < best[0]):
+                    best = (key, position, feasible[order[0]])
+            if best is None:
+                break
+            _, position, new = best
+            out = selected[position]
+            load[less_t[out].indices] -= less_t[out].data
+            load[less_t[new].indices] += less_t[new].data
+            selected[position] = new
+        if (levels(selected) < greater_rhs - self.tolerance).any():
+            return(None)
+        return(np.sort(selected))
+
+    def solve(self):
+        #selected columns of xij over all periods, None when some period could not be filled
+        n_recipes = self.builder.expansion.n_recipes
+        recent = []
+        selected = []
+        for period_pos in range(self.builder.n_periods):
+            blocked = np.zeros(n_recipes, dtype=bool)
+            for recipes in recent[-self.repetition_interval:] if self.repetition_interval > 0 else []:
+                blocked[recipes] = True
+            local = self.fill_period(period_pos, blocked)
+            if local is None:
+                print('constructive heuristic: period {} could not be filled'.format(self.builder.period_list[period_pos]))
+                return(None)
+            cols = self.columns[period_pos][local]
+            recent.append(self.builder.recipe_pos[cols])
+            selected.append(cols)
+        return(np.sort(np.concatenate(selected)))
+
+
+def constructive_plan(owner, robust=False, profit=None):
+    #selected columns of a feasible plan of a prepared model (see model_setup.prepared_model), None if the heuristic fails
+    #robust: the plan keeps the robust rating rows instead of the nominal constraint_6
+    builder = owner.builder
+    blocks = [builder.nutrient('constraint_3', 'calories', owner.target_calorie),
+              builder.nutrient('constraint_4', 'protein', owner.target_protein),
+              builder.nutrient('constraint_5', 'fat', owner.target_fat)]
+    if not robust:
+        blocks.append(builder.rating('constraint_6', 'rating', owner.target_rating))
+    if profit is not None:
+        blocks.append(builder.profit(profit))
+    blocks += [builder.seasonal('constraint_7', [12, 1, 2], 'summer'),
+               builder.seasonal('constraint_8', [6, 7, 8], 'winter'),
+               builder.tag_cap(owner.target_tags)]
+    heuristic = constructive_heuristic(builder, blocks, builder.values('profit'), owner.repetition_interval,
+                                       (owner.target_rating, owner.r) if robust else None)
+    return(heuristic.solve())
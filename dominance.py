@@ -0,0 +1,46 @@
+import numpy as np
+from period_expansion import SEASONAL_RULES
+from tag_index import tag_index
+
+#recipe columns that only ever help a plan when they are larger: the objectives (profit, rating) and the
+#nutrient minimums; the robust deviation dijmax is a fixed share of rating, so the worst case rating is monotone too
+DOMINANCE_COLUMNS = ('profit', 'rating', 'calories', 'protein', 'fat')
+
+
+def required_dominators(n_assigned, repetition_interval):
+    #kept dominators a recipe needs before it may go: at most this many recipes minus one besides it appear in
+    #periods t - repetition_interval .. t + repetition_interval, so in an optimal plan that uses it in period t
+    #one of its dominators is free to take its place without breaking constraint_1
+    return((2 * repetition_interval + 1) * n_assigned)
+
+
+def prune_recipes(recipes_df, n_assigned, target_tags, repetition_interval, tags=None, columns=DOMINANCE_COLUMNS):
+    #drops recipes that an optimal plan never needs, returns (kept recipes, report)
+    #j dominates i if j is at least as good in every column, matches no tag that i does not match (tags with at
+    #most target_tags recipes are left out, their constraint_9 rows can never bind) and is excluded by no seasonal
+    #rule that spares i; swapping i for j then keeps every row of the models and does not lower the objective
+    if tags is None:
+        tags = tag_index(recipes_df)
+    values = recipes_df[list(columns)].to_numpy(dtype=float)
+    positions = tags.rows(recipes_df['ix'].to_numpy())
+    matrix = tags.matrix[positions].tocsc()
+    binding = np.flatnonzero(np.diff(matrix.indptr) > target_tags)
+    seasonal = np.column_stack([tags.any_of(tag)[positions] for periods, tag in SEASONAL_RULES])
+    #restrictions[k] = tags that can bind and seasonal exclusions of recipe k, j may replace i if j's are a subset of i's
+    restrictions = np.hstack([matrix[:, binding].toarray() > 0, seasonal])
+    needed = required_dominators(n_assigned, repetition_interval)
+    removed = np.zeros(len(recipes_df), dtype=bool)
+    kept = []
+    #best first, so every dominator of a recipe is decided before the recipe itself
+    for recipe in np.lexsort(values.T[::-1])[::-1]:
+        if len(kept) >= needed:
+            candidates = np.asarray(kept)
+            candidates = candidates[(values[candidates] >= values[recipe]).all(axis=1)]
+            if len(candidates) >= needed:
+                subset = ~(restrictions[candidates] & ~restrictions[recipe]).any(axis=1)
+                if subset.sum() >= needed:
+                    removed[recipe] = True
+                    continue
+        kept.append(recipe)
+    report = {'recipes': len(recipes_df), 'removed': int(removed.sum()), 'required_dominators': needed}
+    return(recipes_df[~removed].reset_index(drop=True), report)
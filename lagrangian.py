@@ -0,0 +1,270 @@
+import argparse
+import json
+import multiprocessing
+import time
+
+import numpy as np
+import scipy.sparse as sp
+from mip import LinExpr, MAXIMIZE, BINARY, CONTINUOUS, maximize
+from model_builder import constraint_block, load_blocks
+from solver_backend import solver_backend
+from model_setup import prepared_model
+
+
+def model_blocks(owner, robust=False, profit=None):
+    #the constraint families of a prepared model except constraint_1, over xij (+ zij, wj when robust)
+    #the rating rows are the nominal constraint_6, or the compact robust rating rows with robust=True
+    builder = owner.builder
+    blocks = [builder.assignment(owner.n_assigned),
+              builder.nutrient('constraint_3', 'calories', owner.target_calorie),
+              builder.nutrient('constraint_4', 'protein', owner.target_protein),
+              builder.nutrient('constraint_5', 'fat', owner.target_fat)]
+    if robust:
+        blocks += builder.robust_rating_rows(owner.target_rating, owner.r, 'compact')
+    else:
+        blocks.append(builder.rating('constraint_6', 'rating', owner.target_rating))
+    if profit is not None:
+        blocks.append(builder.profit(profit))
+    blocks += [builder.seasonal('constraint_7', [12, 1, 2], 'summer'),
+               builder.seasonal('constraint_8', [6, 7, 8], 'winter'),
+               builder.tag_cap(owner.target_tags)]
+    return(blocks)
+
+
+def column_periods(builder, robust=False):
+    #period position of every model column: xij, then zij and wj when robust
+    if robust:
+        return(np.concatenate([builder.period_pos, builder.period_pos, np.arange(builder.n_periods)]))
+    return(builder.period_pos)
+
+
+def split_by_period(blocks, col_period, n_periods):
+    #per period position, the blocks restricted to the columns of that period
+    #a row must lie in one period, or be a zero row (= 0, nonnegative coefficients) that splits into one per period
+    n_cols = len(col_period)
+    pieces = [[] for _ in range(n_periods)]
+    columns = [np.flatnonzero(col_period == period_pos) for period_pos in range(n_periods)]
+    for block in blocks:
+        matrix = sp.csr_matrix((block.matrix.data, block.matrix.indices, block.matrix.indptr), shape=(block.num_rows, n_cols))
+        entry_period = col_period[matrix.indices]
+        rows = np.repeat(np.arange(block.num_rows), np.diff(matrix.indptr))
+        first = np.full(block.num_rows, n_periods)
+        last = np.full(block.num_rows, -1)
+        np.minimum.at(first, rows, entry_period)
+        np.maximum.at(last, rows, entry_period)
+        spanning = np.flatnonzero((first < last) & (last >= 0))
+        for row in spanning:
+            start, end = matrix.indptr[row], matrix.indptr[row + 1]
+            if block.sense != '=' or block.rhs[row] != 0 or (matrix.data[start:end] < 0).any():
+                raise ValueError('row {} of {} links periods and cannot be split'.format(row, block.name))
+        for period_pos in range(n_periods):
+            selected = np.flatnonzero((first == period_pos) & (last == period_pos))
+            selected = np.union1d(selected, spanning)
+            submatrix = matrix[selected][:, columns[period_pos]]
+            keep = np.flatnonzero(np.diff(submatrix.indptr))
+            if len(keep):
+                pieces[period_pos].append(constraint_block(block.name, submatrix[keep], block.sense, block.rhs[selected][keep]))
+    return(columns, pieces)
+
+
+def subproblem_model(backend, names, var_types, blocks, forbidden=()):
+    mipmodel = backend.model(MAXIMIZE)
+    mipmodel.verbose = 0
+    variables = [mipmodel.add_var(name=name, var_type=var_type) for name, var_type in zip(names, var_types)]
+    for index in forbidden:
+        variables[index].ub = 0.0
+    load_blocks(mipmodel, variables, blocks)
+    return(mipmodel, variables)
+
+
+def subproblem_worker(connection, subproblems, solver_name, threads, max_seconds, max_mip_gap):
+    #owns the models of some periods, every message is a list of (period_pos, objective coeffs, forbidden columns)
+    #and is answered with a list of (period_pos, solve_result) in the same order; None ends the worker
+    backend = solver_backend(solver_name, threads, max_seconds, max_mip_gap)
+    models = {period_pos: subproblem_model(backend, *subproblem) for period_pos, subproblem in subproblems.items()}
+    while True:
+        message = connection.recv()
+        if message is None:
+            break
+        results = []
+        for period_pos, coeffs, forbidden in message:
+            if len(forbidden):
+                #a fresh model: CBC keeps the cutoff of its last solve when bounds change and then reports garbage
+                mipmodel, variables = subproblem_model(backend, *subproblems[period_pos], forbidden)
+            else:
+                mipmodel, variables = models[period_pos]
+            mipmodel.objective = maximize(LinExpr(variables=variables, coeffs=coeffs.tolist()))
+            results.append((period_pos, backend.optimize(mipmodel)))
+        connection.send(results)
+    connection.close()
+
+
+class lagrangian_decomposition():
+    #relaxes the repetition rows (constraint_1) with multipliers λ >= 0, the rest of the model splits into one
+    #subproblem per period, solved by jobs worker processes:
+    #L(λ) = ∑ j max{(c - A'λ) x : x feasible in period j} + ∑ λ >= optimum, minimized by subgradient steps
+    #every repair_every iterations the relaxed solution is repaired into a feasible plan period by period
+    def __init__(self, owner, robust=False, profit=None, objective='profit', jobs=1, solver_name='CBC',
+                 threads=1, max_seconds=600, max_mip_gap=1e-4):
+        builder = owner.builder
+        self.builder = builder
+        self.n_x = builder.n_x
+        self.n_periods = builder.n_periods
+        repetition = builder.repetition(owner.repetition_interval)
+        self.relaxed = repetition.matrix
+        self.relaxed_rhs = repetition.rhs
+        col_period = column_periods(builder, robust)
+        self.columns, pieces = split_by_period(model_blocks(owner, robust, profit), col_period, self.n_periods)
+        prefixes = np.array(['x'] * self.n_x + ['z'] * (len(col_period) - self.n_x))
+        local = np.concatenate([np.arange(self.n_x), np.arange(len(col_period) - self.n_x)])
+        self.objective = np.zeros(len(col_period))
+        self.objective[:self.n_x] = builder.values(objective) / (owner.n_assigned * self.n_periods)
+        if robust:
+            prefixes[2 * self.n_x:] = 'w'
+            local[2 * self.n_x:] = np.arange(self.n_periods)
+        subproblems = {}
+        for period_pos, cols in enumerate(self.columns):
+            names = [prefix + str(index) for prefix, index in zip(prefixes[cols], local[cols])]
+            var_types = [BINARY if col < self.n_x else CONTINUOUS for col in cols]
+            subproblems[period_pos] = (names, var_types, pieces[period_pos])
+        #periods are dealt round robin to the workers
+        self.jobs = min(jobs, self.n_periods)
+        self.owner_of = np.arange(self.n_periods) % self.jobs
+        self.connections = []
+        self.workers = []
+        context = multiprocessing.get_context('spawn')
+        for job in range(self.jobs):
+            parent, child = context.Pipe()
+            mine = {period_pos: subproblems[period_pos] for period_pos in np.flatnonzero(self.owner_of == job)}
+            worker = context.Process(target=subproblem_worker,
+                                     args=(child, mine, solver_name, threads, max_seconds, max_mip_gap))
+            worker.start()
+            self.connections.append(parent)
+            self.workers.append(worker)
+
+    def close(self):
+        for connection, worker in zip(self.connections, self.workers):
+            connection.send(None)
+            worker.join()
+        self.connections = []
+        self.workers = []
+
+    def solve_periods(self, objective, forbidden=None):
+        #solves the given periods in parallel, objective: {period_pos: coeffs over all model columns}
+        #returns {period_pos: solve_result}
+        if forbidden is None:
+            forbidden = {}
+        messages = [[] for _ in range(self.jobs)]
+        for period_pos, coeffs in objective.items():
+            cols = self.columns[period_pos]
+            local_forbidden = np.flatnonzero(np.isin(cols, forbidden.get(period_pos, [])))
+            messages[self.owner_of[period_pos]].append((period_pos, coeffs[cols], local_forbidden))
+        for connection, message in zip(self.connections, messages):
+            if message:
+                connection.send(message)
+        results = {}
+        for connection, message in zip(self.connections, messages):
+            if message:
+                results.update(connection.recv())
+        return(results)
+
+    def plan(self, results):
+        #xij of the period solutions as one vector over the xij columns
+        x = np.zeros(self.n_x)
+        for period_pos, result in results.items():
+            cols = self.columns[period_pos]
+            x_part = cols < self.n_x
+            x[cols[x_part]] = np.round(result.values[x_part])
+        return(x)
+
+    def repair(self, coeffs):
+        #period by period, solves with the objective coeffs and forbids the columns that would share a repetition
+        #window with a column already chosen; returns (objective value, xij) or None if a period becomes infeasible
+        x = np.zeros(self.n_x)
+        for period_pos in range(self.n_periods):
+            used = self.relaxed @ x
+            blocked = self.relaxed.T @ (used >= self.relaxed_rhs - 0.5).astype(float)
+            forbidden = np.flatnonzero(blocked[:self.n_x] > 0)
+            result = self.solve_periods({period_pos: coeffs}, {period_pos: forbidden})[period_pos]
+            if not result.has_solution:
+                return(None)
+            x += self.plan({period_pos: result})
+        return(float(self.objective[:self.n_x] @ x), x)
+
+    def solve(self, iterations=100, step_scale=2.0, patience=5, repair_every=5, tolerance=1e-3, max_seconds=3600):
+        #subgradient optimization of λ, returns the best bound, the best repaired plan and the iteration history
+        start = time.time()
+        multipliers = np.zeros(self.relaxed.shape[0])
+        upper_bound = np.inf
+        lower_bound = -np.inf
+        best_plan = None
+        gap = np.inf
+        history = []
+        stalled = 0
+        for iteration in range(iterations):
+            coeffs = self.objective.copy()
+            coeffs[:self.n_x] -= self.relaxed.T @ multipliers
+            results = self.solve_periods({period_pos: coeffs for period_pos in range(self.n_periods)})
+            if not all(result.has_solution for result in results.values()):
+                raise RuntimeError('a period subproblem has no solution, the model is infeasible or the time limit is too short')
+            #the subproblem bounds keep L(λ) a valid bound when a subproblem stops at its gap or time limit
+            value = sum(result.objective_bound for result in results.values()) + multipliers @ self.relaxed_rhs
+            x = self.plan(results)
+            subgradient = self.relaxed_rhs - self.relaxed @ x
+            if value < upper_bound - 1e-9:
+                upper_bound = value
+                stalled = 0
+            else:
+                stalled += 1
+                if stalled >= patience:
+                    step_scale /= 2
+                    stalled = 0
+            if (subgradient >= 0).all():
+                #the relaxed solution keeps the repetition rows, it is a plan as it is
+                candidate = (float(self.objective[:self.n_x] @ x), x)
+            elif iteration % repair_every == 0 or iteration == iterations - 1:
+                candidate = self.repair(coeffs)
+            else:
+                candidate = None
+            if candidate is not None and candidate[0] > lower_bound:
+                lower_bound, best_plan = candidate
+            gap = (upper_bound - lower_bound) / max(abs(lower_bound), 1e-10)
+            history.append({'iteration': iteration, 'seconds': time.time() - start, 'lagrangian': value,
+                            'upper_bound': upper_bound, 'lower_bound': lower_bound, 'gap': gap,
+                            'violated_rows': int((subgradient < 0).sum()), 'step_scale': step_scale})
+            print('iteration {}: L = {:.6f}, bound {:.6f}, plan {:.6f}, gap {:.4%}'.format(
+                iteration, value, upper_bound, lower_bound, gap))
+            if gap <= tolerance or time.time() - start > max_seconds or not (subgradient != 0).any():
+                break
+            #Polyak step towards the best plan value (5% below the bound before a plan is known)
+            target = lower_bound if np.isfinite(lower_bound) else value - 0.05 * abs(value)
+            step = step_scale * (value - target) / max(subgradient @ subgradient, 1e-10)
+            multipliers = np.maximum(0.0, multipliers - step * subgradient)
+        selected = None if best_plan is None else np.flatnonzero(best_plan > 0.5)
+        return({'upper_bound': upper_bound, 'objective_value': lower_bound, 'gap': gap,
+                'selected_columns': selected, 'multipliers': multipliers, 'history': history})
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Lagrangian period decomposition of a model, repetition rows relaxed')
+    parser.add_argument('model', nargs='?', default='model_2')
+    parser.add_argument('--parameters', default='{}', help='json object of model parameters')
+    parser.add_argument('--robust', action='store_true', help='robust rating rows instead of the nominal ones')
+    parser.add_argument('--data', default='cleaned_db.csv')
+    parser.add_argument('--jobs', type=int, default=1)
+    parser.add_argument('--solver', default='CBC')
+    parser.add_argument('--iterations', type=int, default=100)
+    parser.add_argument('--max-seconds', type=float, default=3600)
+    parser.add_argument('--output', default='result_lagrangian')
+    args = parser.parse_args()
+    owner = prepared_model(args.model, args.data, json.loads(args.parameters))
+    decomposition = lagrangian_decomposition(owner, args.robust, jobs=args.jobs, solver_name=args.solver)
+    try:
+        solution = decomposition.solve(args.iterations, max_seconds=args.max_seconds)
+    finally:
+        decomposition.close()
+    print('bound {}, best plan {}'.format(solution['upper_bound'], solution['objective_value']))
+    if solution['selected_columns'] is not None:
+        result_df = owner.expansion.frame(solution['selected_columns'])
+        result_df.to_csv(args.output)
+        print(result_df)
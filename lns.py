@@ -0,0 +1,192 @@
+import argparse
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from mip import LinExpr, MAXIMIZE, BINARY, CONTINUOUS, maximize
+from model_builder import constraint_block, load_blocks
+from lagrangian import model_blocks
+from constructive import constructive_plan
+from solver_backend import solver_backend
+from model_setup import prepared_model
+
+#ways to pick the part of the model a sub-MIP frees, everything else stays at the incumbent
+NEIGHBOURHOODS = ('periods', 'tag', 'profit')
+
+
+def restrict(blocks, free, values):
+    #the blocks over the free columns only, the other columns fixed at values (one value per model column)
+    #rows without a free column hold at the incumbent and are left out
+    fixed = np.ones(len(values), dtype=bool)
+    fixed[free] = False
+    restricted = []
+    for block in blocks:
+        matrix = sp.csr_matrix((block.matrix.data, block.matrix.indices, block.matrix.indptr),
+                               shape=(block.num_rows, len(values)))
+        rhs = block.rhs - matrix[:, fixed] @ values[fixed]
+        submatrix = matrix[:, free]
+        keep = np.flatnonzero(np.diff(submatrix.indptr))
+        if len(keep):
+            restricted.append(constraint_block(block.name, submatrix[keep], block.sense, rhs[keep]))
+    return(restricted)
+
+
+def solve_neighbourhood(names, var_types, blocks, coeffs, start, solver_name, threads, max_seconds, max_mip_gap):
+    #one sub-MIP over the freed columns, run in a worker process; returns its solve_result
+    backend = solver_backend(solver_name, threads, max_seconds, max_mip_gap)
+    mipmodel = backend.model(MAXIMIZE)
+    mipmodel.verbose = 0
+    variables = [mipmodel.add_var(name=name, var_type=var_type) for name, var_type in zip(names, var_types)]
+    load_blocks(mipmodel, variables, blocks)
+    mipmodel.objective = maximize(LinExpr(variables=variables, coeffs=coeffs.tolist()))
+    return(backend.optimize(mipmodel, [(var, value) for var, value in zip(variables, start) if value != 0]))
+
+
+class large_neighbourhood_search():
+    #improves an incumbent plan of a prepared model: every round frees jobs neighbourhoods (a few consecutive
+    #periods, the recipes of one tag, or one profit band of recipes in all periods), re-solves each sub-MIP with a
+    #short time limit in its own worker process and keeps the best improvement
+    #robust: the robust rating rows (compact) instead of the nominal ones, their zij and wj are always free
+    def __init__(self, owner, robust=False, profit=None, jobs=1, solver_name='CBC', threads=1, sub_seconds=30,
+                 max_mip_gap=1e-4, neighbourhoods=NEIGHBOURHOODS, periods=2, band=0.1, seed=0):
+        for neighbourhood in neighbourhoods:
+            if neighbourhood not in NEIGHBOURHOODS:
+                raise ValueError('unknown neighbourhood {}, expected one of {}'.format(neighbourhood, NEIGHBOURHOODS))
+        self.owner = owner
+        self.builder = owner.builder
+        self.robust = robust
+        self.n_x = self.builder.n_x
+        self.n_cols = self.builder.num_cols(robust)
+        self.blocks = [self.builder.repetition(owner.repetition_interval)] + model_blocks(owner, robust, profit)
+        self.objective = np.zeros(self.n_cols)
+        self.objective[:self.n_x] = self.builder.values('profit') / (owner.n_assigned * self.builder.n_periods)
+        names = ['x{}'.format(col) for col in range(self.n_x)]
+        if robust:
+            names += ['z{}'.format(col) for col in range(self.n_x)] + ['w{}'.format(period_pos) for period_pos in range(self.builder.n_periods)]
+        self.names = np.array(names)
+        self.jobs = jobs
+        self.settings = (solver_name, threads, sub_seconds, max_mip_gap)
+        self.neighbourhoods = list(neighbourhoods)
+        self.periods = periods
+        self.band = band
+        self.random = np.random.default_rng(seed)
+        #profit rank of every recipe in [0, 1), the profit bands are ranges of it
+        profit_values = owner.recipes_df['profit'].to_numpy()
+        self.profit_rank = np.argsort(np.argsort(profit_values, kind='stable'), kind='stable') / len(profit_values)
+
+    def values(self, selected):
+        #all model columns of the plan with the given xij columns, zij and wj at their smallest feasible values
+        values = np.zeros(self.n_cols)
+        values[selected] = 1.0
+        if self.robust:
+            z, w = self.builder.robust_values(values[:self.n_x], self.owner.r)
+            values[self.n_x:2 * self.n_x] = z
+            values[2 * self.n_x:] = w
+        return(values)
+
+    def neighbourhood(self, kind, values):
+        #(description, xij columns freed by a random neighbourhood of the given kind)
+        builder = self.builder
+        if kind == 'periods':
+            length = min(self.periods, builder.n_periods)
+            first = int(self.random.integers(builder.n_periods - length + 1))
+            free = np.flatnonzero((builder.period_pos >= first) & (builder.period_pos < first + length))
+            return('periods {}..{}'.format(builder.period_list[first], builder.period_list[first + length - 1]), free)
+        if kind == 'tag':
+            #a tag of the incumbent's recipes, its recipes are free in every period
+            tags = self.builder.tags
+            recipe_rows = pd.Index(tags.recipe_ids).get_indexer(builder.expansion.recipe_ids)
+            used = np.unique(recipe_rows[builder.recipe_pos[np.flatnonzero(values[:self.n_x] > 0.5)]])
+            candidates = np.unique(tags.matrix[used].indices)
+            #an incumbent without tagged recipes has no tag to free, a window of periods is freed instead
+            if not len(candidates):
+                return(self.neighbourhood('periods', values))
+            tag = int(self.random.choice(candidates))
+            tagged = tags.matrix[:, tag].toarray().ravel()[recipe_rows] > 0
+            return('tag {}'.format(tags.vocabulary[tag]), np.flatnonzero(tagged[builder.recipe_pos]))
+        low = float(self.random.uniform(0, 1 - self.band))
+        rank = self.profit_rank[builder.recipe_pos]
+        return('profit band {:.2f}..{:.2f}'.format(low, low + self.band),
+               np.flatnonzero((rank >= low) & (rank < low + self.band)))
+
+    def sub_problem(self, free_x, values):
+        #arguments of solve_neighbourhood for the freed xij columns (plus every zij and wj)
+        free = np.concatenate([free_x, np.arange(self.n_x, self.n_cols)])
+        var_types = [BINARY] * len(free_x) + [CONTINUOUS] * (self.n_cols - self.n_x)
+        return(free, (self.names[free].tolist(), var_types, restrict(self.blocks, free, values), self.objective[free], values[free]))
+
+    def solve(self, start_columns, max_seconds=600, patience=10, tolerance=1e-6):
+        #improves the plan with xij columns start_columns until max_seconds have passed or
+        #patience rounds in a row found nothing better; returns the best plan and the history
+        values = self.values(start_columns)
+        incumbent = float(self.objective @ values)
+        start = time.time()
+        history = [{'round': 0, 'seconds': 0.0, 'objective_value': incumbent, 'neighbourhood': 'start'}]
+        print('start: {:.6f}'.format(incumbent))
+        stalled = 0
+        with ProcessPoolExecutor(max_workers=self.jobs) as pool:
+            round_number = 0
+            while time.time() - start < max_seconds and stalled < patience:
+                round_number += 1
+                futures = []
+                for job in range(self.jobs):
+                    kind = self.neighbourhoods[(round_number * self.jobs + job) % len(self.neighbourhoods)]
+                    description, free_x = self.neighbourhood(kind, values)
+                    free, arguments = self.sub_problem(free_x, values)
+                    futures.append((description, free, pool.submit(solve_neighbourhood, *arguments, *self.settings)))
+                best = None
+                for description, free, future in futures:
+                    result = future.result()
+                    if not result.has_solution:
+                        continue
+                    candidate = values.copy()
+                    candidate[free] = result.values
+                    value = float(self.objective @ candidate)
+                    if value > incumbent + tolerance and (best is None or value > best[0]):
+                        best = (value, candidate, description)
+                if best is None:
+                    stalled += 1
+                    print('round {}: no improvement'.format(round_number))
+                    continue
+                stalled = 0
+                incumbent, values, description = best
+                values[:self.n_x] = np.round(values[:self.n_x])
+                history.append({'round': round_number, 'seconds': time.time() - start, 'objective_value': incumbent,
+                                'neighbourhood': description})
+                print('round {}: {:.6f} from {}'.format(round_number, incumbent, description))
+        return({'objective_value': incumbent, 'selected_columns': np.flatnonzero(values[:self.n_x] > 0.5),
+                'seconds': time.time() - start, 'history': history})
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='large neighbourhood search around an incumbent plan of a model')
+    parser.add_argument('model', nargs='?', default='model_3')
+    parser.add_argument('--parameters', default='{}', help='json object of model parameters')
+    parser.add_argument('--robust', action='store_true', help='robust rating rows instead of the nominal ones')
+    parser.add_argument('--data', default='cleaned_db.csv')
+    parser.add_argument('--start', help='result csv (e.g. result_model3) to start from, the constructive heuristic otherwise')
+    parser.add_argument('--jobs', type=int, default=1)
+    parser.add_argument('--solver', default='CBC')
+    parser.add_argument('--neighbourhoods', nargs='+', default=list(NEIGHBOURHOODS), choices=NEIGHBOURHOODS)
+    parser.add_argument('--sub-seconds', type=float, default=30, help='time limit of every sub-MIP')
+    parser.add_argument('--max-seconds', type=float, default=600)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='result_lns')
+    args = parser.parse_args()
+    owner = prepared_model(args.model, args.data, json.loads(args.parameters))
+    if args.start:
+        start_columns = pd.read_csv(args.start, index_col=0).index.to_numpy()
+    else:
+        start_columns = constructive_plan(owner, args.robust)
+        if start_columns is None:
+            raise SystemExit('the constructive heuristic found no plan, pass one with --start')
+    search = large_neighbourhood_search(owner, args.robust, jobs=args.jobs, solver_name=args.solver,
+                                        sub_seconds=args.sub_seconds, neighbourhoods=args.neighbourhoods, seed=args.seed)
+    solution = search.solve(start_columns, args.max_seconds)
+    result_df = owner.expansion.frame(solution['selected_columns'])
+    result_df.to_csv(args.output)
+    print('objective {}'.format(solution['objective_value']))
+    print(result_df)
@@ -0,0 +1,362 @@
+import numpy as np
+import scipy.sparse as sp
+from mip import LinExpr, maximize, CONTINUOUS, ConstrsGenerator
+from tag_index import tag_index
+
+
+#how the Γ-robust rating constraint is put into the model:
+#'dualized' (the default of the models): robust_rating plus explicit z >= 0, w >= 0 rows, as in the thesis models
+#'compact': robust_rating only, z and w are nonnegative through their bounds; the z >= 0, w >= 0 rows are single
+#variable rows that presolve turns into bounds anyway, so this is the same model to the solver, still one protection
+#row per period and one z per x, it only leaves those rows out of the build
+#'cuts': no z and w, the worst case rows violated by a solution are added lazily (robust_rating_cuts, Gurobi only);
+#the only formulation that is really smaller
+ROBUST_FORMULATIONS = ('dualized', 'compact', 'cuts')
+
+
+class constraint_block():
+    #one constraint family: rows of a CSR matrix over the model columns, a sense ('<', '>', '=') and a rhs per row
+    def __init__(self, name, matrix, sense, rhs):
+        self.name = name
+        self.matrix = sp.csr_matrix(matrix)
+        self.matrix.sort_indices()
+        self.sense = sense
+        self.rhs = np.asarray(rhs, dtype=float)
+
+    @property
+    def num_rows(self):
+        return(self.matrix.shape[0])
+
+    @property
+    def nnz(self):
+        return(self.matrix.nnz)
+
+
+def repetition_matrix(column_grid, repetition_interval, cyclic=False, n_cols=None):
+    #rows of the repetition windows computed from (period, recipe) positions, window-major then recipe
+    #window w covers periods w..w+repetition_interval, with cyclic=True the windows wrap around the horizon
+    n_periods, n_recipes = column_grid.shape
+    if n_cols is None:
+        n_cols = column_grid.max() + 1
+    width = min(repetition_interval + 1, n_periods)
+    if cyclic:
+        n_windows = n_periods if width < n_periods else 1
+    else:
+        n_windows = max(n_periods - repetition_interval, 0)
+    #periods[w, d] is the d-th period of window w
+    periods = (np.arange(n_windows)[:, None] + np.arange(width)[None, :]) % n_periods
+    cols = column_grid[periods]                                   #(window, offset, recipe)
+    rows = np.broadcast_to(np.arange(n_windows)[:, None, None] * n_recipes + np.arange(n_recipes)[None, None, :], cols.shape)
+    cols = cols.ravel()
+    rows = rows.ravel()
+    selected = cols >= 0
+    matrix = sp.csr_matrix((np.ones(selected.sum()), (rows[selected], cols[selected])), shape=(n_windows * n_recipes, n_cols))
+    return(matrix)
+
+
+def load_blocks(mipmodel, variables, blocks, name=None, first=0):
+    #adds the rows of one or more blocks to mipmodel, variables[j] is the variable of column j
+    #every row is named, python-mip's default constr(i) names repeat once rows were removed and a model with
+    #repeated row names does not survive the mps file of the model cache; rows are named block name_row, or
+    #name_first, name_first + 1, ... over all blocks when name is given (block_registry numbers its families)
+    if isinstance(blocks, constraint_block):
+        blocks = [blocks]
+    constrs = []
+    for block in blocks:
+        matrix = block.matrix
+        for row in range(block.num_rows):
+            start, end = matrix.indptr[row], matrix.indptr[row + 1]
+            expr = LinExpr(variables=[variables[j] for j in matrix.indices[start:end]],
+                           coeffs=matrix.data[start:end].tolist(),
+                           const=-block.rhs[row], sense=block.sense)
+            if name is None:
+                row_name = '{}_{}'.format(block.name, row)
+            else:
+                row_name = '{}_{}'.format(name, first + len(constrs))
+            constrs.append(mipmodel.add_constr(expr, name=row_name))
+    return(constrs)
+
+
+class block_registry():
+    #named constraint blocks of one live mipmodel, so a phase can add, drop or retarget a family in place
+    def __init__(self, mipmodel):
+        self.mipmodel = mipmodel
+        self.constrs = {}
+
+    def __contains__(self, name):
+        return(name in self.constrs)
+
+    def names(self):
+        return(list(self.constrs))
+
+    def load(self, name, variables, blocks):
+        #adds the rows of blocks under name (appending if name already exists), named name_0, name_1, ...
+        constrs = load_blocks(self.mipmodel, variables, blocks, name, len(self.constrs.get(name, [])))
+        self.constrs.setdefault(name, []).extend(constrs)
+        return(constrs)
+
+    def remove(self, name):
+        constrs = self.constrs.pop(name)
+        if constrs:
+            self.mipmodel.remove(constrs)
+
+    def set_rhs(self, name, rhs):
+        #rhs is a scalar or one value per row of the block
+        constrs = self.constrs[name]
+        for constr, value in zip(constrs, np.broadcast_to(np.asarray(rhs, dtype=float), (len(constrs),))):
+            constr.rhs = value
+
+    def rows(self):
+        #current row indices of every block, e.g. to store the registry next to a cached model
+        return({name: np.fromiter((constr.idx for constr in constrs), dtype=np.int64, count=len(constrs))
+                for name, constrs in self.constrs.items()})
+
+    @classmethod
+    def from_rows(cls, mipmodel, rows):
+        registry = cls(mipmodel)
+        all_constrs = list(mipmodel.constrs)
+        for name, indices in rows.items():
+            registry.constrs[name] = [all_constrs[index] for index in indices]
+        return(registry)
+
+
+def solution_values(variables):
+    #solution values of variables as one array, position k belongs to variables[k]
+    return(np.fromiter((var.x for var in variables), dtype=float, count=len(variables)))
+
+
+class model_builder():
+    #compiles the constraint families of the meal planning models into sparse matrices
+    #columns are laid out as the models create their variables: xij (one per expansion column), then zij, then wj
+    def __init__(self, expansion, n_assigned, tags=None):
+        self.expansion = expansion
+        self.period_list = expansion.period_list
+        self.n_assigned = n_assigned
+        self.n_x = expansion.n_cols
+        self.n_periods = expansion.n_periods
+        #position of every column's period in period_list and of its recipe in the recipe table
+        self.period_pos = expansion.period_pos
+        self.recipe_pos = expansion.recipe_pos
+        self.x_cols = np.arange(self.n_x)
+        self.z_cols = self.n_x + np.arange(self.n_x)
+        self.w_cols = 2 * self.n_x + np.arange(self.n_periods)
+        #recipe x tag index, built from the recipes when the caller does not share one
+        if tags is None:
+            tags = tag_index(expansion.recipes_df)
+        self.tags = tags
+
+    def add_variables(self, mipmodel, prefix, var_type, n=None):
+        #variables named by their column index, x0..xN for xij, z0..zN for zij and w0..wP for wj
+        if n is None:
+            n = self.n_x
+        return([mipmodel.add_var(name=prefix + str(col), var_type=var_type) for col in range(n)])
+
+    def add_robust_variables(self, mipmodel, formulation='compact'):
+        #zij and wj of the dualized robust rating rows, none when the worst case rows are separated as cuts
+        if formulation == 'cuts':
+            return([], [])
+        return(self.add_variables(mipmodel, 'z', CONTINUOUS), self.add_variables(mipmodel, 'w', CONTINUOUS, self.n_periods))
+
+    def selected_columns(self, values, tolerance=1e-6):
+        #columns whose xij is nonzero, values[k] is the solution value of xij[k]
+        return(np.flatnonzero(np.abs(values) > tolerance))
+
+    def values(self, column):
+        return(self.expansion.values(column).astype(float))
+
+    def num_cols(self, robust=False):
+        if robust:
+            return(2 * self.n_x + self.n_periods)
+        return(self.n_x)
+
+    def per_period(self, name, coeffs, sense, rhs, robust=False):
+        #one row per period with coefficient coeffs[k] on xij of row k
+        coeffs = np.broadcast_to(np.asarray(coeffs, dtype=float), (self.n_x,))
+        matrix = sp.csr_matrix((coeffs, (self.period_pos, self.x_cols)), shape=(self.n_periods, self.num_cols(robust)))
+        return(constraint_block(name, matrix, sense, np.full(self.n_periods, rhs, dtype=float)))
+
+    def objective(self, variables, column):
+        #max ∑ i∈I j∈J cij xij / (n_assigned * |J|)
+        coeffs = self.values(column) / (self.n_assigned * self.n_periods)
+        return(maximize(LinExpr(variables=list(variables[:self.n_x]), coeffs=coeffs.tolist())))
+
+    def column_grid(self):
+        #column of xij for (period position, recipe position), -1 where the pair has no variable
+        #prepare_df lays rows out period-major, so this is normally arange(n_periods * n_recipes) reshaped
+        n_recipes = self.expansion.n_recipes
+        if self.n_x == self.n_periods * n_recipes and np.array_equal(self.period_pos * n_recipes + self.recipe_pos, self.x_cols):
+            return(self.x_cols.reshape(self.n_periods, n_recipes))
+        grid = np.full((self.n_periods, n_recipes), -1)
+        grid[self.period_pos, self.recipe_pos] = self.x_cols
+        return(grid)
+
+    def repetition(self, repetition_interval, cyclic=False):
+        #a recipe is used at most once in every window of repetition_interval + 1 consecutive periods
+        matrix = repetition_matrix(self.column_grid(), repetition_interval, cyclic, self.n_x)
+        #a window with one column or none always holds, unavailable pairs (see available_pairs) leave such rows
+        matrix = matrix[np.flatnonzero(np.diff(matrix.indptr) > 1)]
+        return(constraint_block('constraint_1', matrix, '<', np.ones(matrix.shape[0])))
+
+    def assignment(self, n_assigned):
+        return(self.per_period('constraint_2', 1.0, '=', n_assigned))
+
+    def nutrient(self, name, column, target):
+        #average nutrient per assigned recipe is at least the target
+        return(self.per_period(name, self.values(column) / self.n_assigned, '>', target))
+
+    def rating(self, name, column, target_rating):
+        return(self.per_period(name, self.values(column), '>', self.n_assigned * target_rating))
+
+    def profit(self, profit):
+        return(self.per_period('constraint_6_profit', self.values('profit'), '>', self.n_assigned * profit))
+
+    def robust_rating(self, target_rating, r):
+        #∑ rij xij - r wj - ∑ zij >= n_assigned * target   (one row per period)
+        #wj + zij - dijmax xij >= 0                        (one row per main_df row)
+        n_cols = self.num_cols(robust=True)
+        rating = self.values('rating')
+        dijmax = self.values('dijmax')
+        rows = np.concatenate([self.period_pos, self.period_pos, np.arange(self.n_periods)])
+        cols = np.concatenate([self.x_cols, self.z_cols, self.w_cols])
+        data = np.concatenate([rating, -np.ones(self.n_x), np.full(self.n_periods, -float(r))])
+        budget = sp.csr_matrix((data, (rows, cols)), shape=(self.n_periods, n_cols))
+
+        rows = np.concatenate([np.arange(self.n_x)] * 3)
+        cols = np.concatenate([self.w_cols[self.period_pos], self.z_cols, self.x_cols])
+        data = np.concatenate([np.ones(self.n_x), np.ones(self.n_x), -dijmax])
+        protection = sp.csr_matrix((data, (rows, cols)), shape=(self.n_x, n_cols))
+
+        return([constraint_block('constraint_6_robust', budget, '>', np.full(self.n_periods, self.n_assigned * target_rating)),
+                constraint_block('constraint_6_protection', protection, '>', np.zeros(self.n_x))])
+
+    def robust_values(self, values, r):
+        #zij and wj of the dualized rows for an xij solution: wj is the r-th largest deviation of period j,
+        #zij what a column deviates beyond it, so r wj + ∑ zij is the sum of the r largest deviations
+        deviation = self.values('dijmax') * values
+        w = np.zeros(self.n_periods)
+        r = int(r)
+        for period_pos, cols in enumerate(self.column_grid()):
+            cols = cols[cols >= 0]
+            if r >= 1 and len(cols) >= r:
+                w[period_pos] = np.partition(deviation[cols], len(cols) - r)[len(cols) - r]
+        return(np.maximum(deviation - w[self.period_pos], 0), w)
+
+    def robust_rating_rows(self, target_rating, r, formulation='compact'):
+        #the robust rating family in one of ROBUST_FORMULATIONS, rows over xij (+ zij, wj when dualized)
+        if formulation not in ROBUST_FORMULATIONS:
+            raise ValueError('unknown robust formulation {}'.format(formulation))
+        if formulation == 'cuts':
+            #no deviation at all is one of the worst case rows, the others are separated by robust_rating_cuts
+            return(self.rating('constraint_6_robust', 'rating', target_rating))
+        blocks = self.robust_rating(target_rating, r)
+        if formulation == 'dualized':
+            blocks.append(self.nonnegative())
+        return(blocks)
+
+    def nonnegative(self):
+        #explicit w >= 0 and z >= 0 rows of constraint_6_robust
+        n_cols = self.num_cols(robust=True)
+        cols = np.concatenate([self.w_cols, self.z_cols])
+        matrix = sp.csr_matrix((np.ones(len(cols)), (np.arange(len(cols)), cols)), shape=(len(cols), n_cols))
+        return(constraint_block('constraint_6_nonnegative', matrix, '>', np.zeros(len(cols))))
+
+    def seasonal(self, name, periods, tag):
+        #a single row forcing all recipes tagged with tag to zero in the given periods
+        #no row at all when the expansion has no such columns (prepare_df leaves them out, see SEASONAL_RULES)
+        tagged = self.tags.any_of(tag)[self.tags.rows(self.expansion.recipe_ids)]
+        selected = np.isin(self.expansion.period_of(self.x_cols), periods) & tagged[self.recipe_pos]
+        cols = self.x_cols[selected]
+        if not len(cols):
+            return(constraint_block(name, sp.csr_matrix((0, self.n_x)), '=', np.zeros(0)))
+        matrix = sp.csr_matrix((np.ones(len(cols)), (np.zeros(len(cols), dtype=int), cols)), shape=(1, self.n_x))
+        return(constraint_block(name, matrix, '=', [0.0]))
+
+    def tag_cap(self, target_tags):
+        #at most target_tags recipes matching each tag per period, one row per (period, tag)
+        #(column x tag) incidence is a single product of the column -> recipe map with the recipe x tag matrix
+        n_tags = len(self.tags.vocabulary)
+        recipe_of_column = self.tags.rows(self.expansion.recipe_ids)[self.recipe_pos]
+        columns = sp.csr_matrix((np.ones(self.n_x), (self.x_cols, recipe_of_column)), shape=(self.n_x, len(self.tags.recipe_ids)))
+        incidence = (columns @ self.tags.matrix).tocoo()
+        rows = self.period_pos[incidence.row] * n_tags + incidence.col
+        matrix = sp.csr_matrix((np.ones(len(rows)), (rows, incidence.row)), shape=(self.n_periods * n_tags, self.n_x))
+        #empty rows would read 0 <= target_tags, leave them out
+        matrix = matrix[np.flatnonzero(np.diff(matrix.indptr))]
+        return(constraint_block('constraint_9', matrix, '<', np.full(matrix.shape[0], target_tags, dtype=float)))
+
+
+class robust_rating_cuts():
+    #worst case rows of the Γ-robust rating constraint, one per period and deviating set S, |S| <= r:
+    #∑ rij xij - ∑ i∈S dijmax xij >= n_assigned * target_rating
+    #the most violated S of a period is its r columns with the largest dijmax * xij
+    def __init__(self, builder, target_rating, r, tolerance=1e-6):
+        self.rhs = builder.n_assigned * target_rating
+        self.r = int(r)
+        self.tolerance = tolerance
+        self.rating = builder.values('rating')
+        self.dijmax = builder.values('dijmax')
+        self.grid = builder.column_grid()
+
+    def separate(self, values):
+        #(columns, coeffs, sense, rhs) of the violated worst case row of every period, values[k] is the value of xij[k]
+        cuts = []
+        for cols in self.grid:
+            cols = cols[cols >= 0]
+            deviation = self.dijmax[cols] * values[cols]
+            worst = np.argsort(-deviation)[:self.r]
+            if self.rating[cols] @ values[cols] - deviation[worst].sum() < self.rhs - self.tolerance:
+                coeffs = self.rating[cols].copy()
+                coeffs[worst] -= self.dijmax[cols[worst]]
+                cuts.append((cols, coeffs, '>', self.rhs))
+        return(cuts)
+
+
+class block_cuts():
+    #rows of constraint blocks over xij that are checked against a solution instead of being loaded up front
+    def __init__(self, blocks, tolerance=1e-6):
+        if isinstance(blocks, constraint_block):
+            blocks = [blocks]
+        self.blocks = blocks
+        self.tolerance = tolerance
+
+    def separate(self, values):
+        #(columns, coeffs, sense, rhs) of every violated row, one sparse product per block
+        cuts = []
+        for block in self.blocks:
+            slack = block.matrix @ values - block.rhs
+            if block.sense == '<':
+                violated = slack > self.tolerance
+            elif block.sense == '>':
+                violated = slack < -self.tolerance
+            else:
+                violated = np.abs(slack) > self.tolerance
+            matrix = block.matrix
+            for row in np.flatnonzero(violated):
+                start, end = matrix.indptr[row], matrix.indptr[row + 1]
+                cuts.append((matrix.indices[start:end], matrix.data[start:end], block.sense, block.rhs[row]))
+        return(cuts)
+
+
+class lazy_constraints(ConstrsGenerator):
+    #rows over xij that are left out of the model and added when a solution violates them
+    #separators: objects with separate(values) -> [(columns, coeffs, sense, rhs)], e.g. block_cuts, robust_rating_cuts
+    def __init__(self, xij, separators):
+        self.xij = xij
+        self.separators = separators
+
+    def rows(self, variables, values):
+        #the violated rows as constraints over variables (variables[k] belongs to xij[k])
+        #a None variable was presolved out of the model the callback sees, it is fixed at 0 and left out
+        rows = []
+        for separator in self.separators:
+            for cols, coeffs, sense, rhs in separator.separate(values):
+                kept = [index for index, col in enumerate(cols) if variables[col] is not None]
+                rows.append(LinExpr(variables=[variables[cols[index]] for index in kept],
+                                    coeffs=np.asarray(coeffs)[kept].tolist(), const=-rhs, sense=sense))
+        return(rows)
+
+    def generate_constrs(self, model, depth=0, npass=0):
+        variables = model.translate(self.xij)
+        values = np.array([0.0 if var is None else var.x for var in variables])
+        for row in self.rows(variables, values):
+            model += row
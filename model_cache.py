@@ -0,0 +1,144 @@
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+from mip import LinExpr, Model, MAXIMIZE, MINIMIZE, maximize, minimize
+from model_builder import block_registry
+
+#attributes of a model class that change the built model; solver settings are deliberately not part of the key
+MODEL_PARAMETERS = ('period_number', 'n_assigned', 'r', 'deviation_percentage', 'repetition_interval',
+                    'target_calorie', 'target_protein', 'target_fat', 'target_rating', 'target_tags', 'profit',
+                    'robust_formulation', 'lazy_rows', 'prune_dominated', 'tag_matching')
+
+
+def parameters_of(owner):
+    parameters = {}
+    for name in MODEL_PARAMETERS:
+        if hasattr(owner, name):
+            value = getattr(owner, name)
+            parameters[name] = value.item() if isinstance(value, np.generic) else value
+    return(parameters)
+
+
+def data_hash(recipes_df):
+    #hash of the recipe table content, column names included
+    digest = hashlib.sha256()
+    digest.update(json.dumps([str(column) for column in recipes_df.columns]).encode())
+    digest.update(pd.util.hash_pandas_object(recipes_df, index=True).to_numpy().tobytes())
+    return(digest.hexdigest())
+
+
+def write_mps(mipmodel, path):
+    #writes mipmodel as a gzip compressed mps file at path
+    #Gurobi writes 'name.mps' as asked, CBC compresses on its own and writes 'name.mps.mps.gz'
+    base = path[:-len('.gz')]
+    mipmodel.write(base)
+    if os.path.exists(base):
+        with open(base, 'rb') as source, gzip.open(path, 'wb') as target:
+            shutil.copyfileobj(source, target)
+        os.remove(base)
+    else:
+        os.replace(base + '.mps.gz', path)
+
+
+class model_cache():
+    #content-addressed store of built models: key = hash(recipe data, model name, parameters)
+    #every entry is <key>.mps.gz (the model), <key>.npz (objective and row/column layout) and <key>.json (what was built)
+    def __init__(self, directory='model_cache'):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, recipes_df, name, owner):
+        parameters = parameters_of(owner)
+        content = {'data': data_hash(recipes_df), 'name': name, 'parameters': parameters}
+        if hasattr(owner, 'expansion'):
+            content['columns'] = owner.expansion.fingerprint()
+        content = json.dumps(content, sort_keys=True)
+        return(hashlib.sha256(content.encode()).hexdigest()[:32])
+
+    def path(self, key, extension):
+        return(os.path.join(self.directory, key + extension))
+
+    def contains(self, key):
+        return(all(os.path.exists(self.path(key, extension)) for extension in ('.mps.gz', '.npz', '.json')))
+
+    def store(self, key, mipmodel, variables, description=None, blocks=None):
+        #variables: ordered {name: list of variables}, in the order the columns were created
+        #blocks: optional block_registry of mipmodel, its row ranges are restored on load
+        #rows of the mps file are matched by name, a repeated name would merge two rows on load
+        names = [constr.name for constr in mipmodel.constrs]
+        if len(set(names)) != len(names):
+            raise ValueError('model {} has repeated row names and cannot be cached'.format(description))
+        write_mps(mipmodel, self.path(key, '.mps.gz'))
+        objective = mipmodel.objective.expr
+        objective_cols = np.fromiter((var.idx for var in objective), dtype=np.int64, count=len(objective))
+        objective_coeffs = np.fromiter(objective.values(), dtype=float, count=len(objective))
+        block_rows = {} if blocks is None else blocks.rows()
+        #column types and bounds, CBC writes wrong bound types (SC, UI) for columns added after an earlier write
+        all_vars = mipmodel.vars
+        var_types = np.array([var.var_type for var in all_vars], dtype='<U1')
+        var_bounds = np.array([(var.lb, var.ub) for var in all_vars], dtype=float).reshape(-1, 2)
+        np.savez_compressed(self.path(key, '.npz'), objective_cols=objective_cols, objective_coeffs=objective_coeffs,
+                            var_types=var_types, var_bounds=var_bounds,
+                            **{'block_' + name: rows for name, rows in block_rows.items()})
+        metadata = {'sense': mipmodel.sense,
+                    'variables': [[name, len(variable_list)] for name, variable_list in variables.items()],
+                    'blocks': list(block_rows),
+                    'num_rows': mipmodel.num_rows, 'num_cols': mipmodel.num_cols, 'num_nz': mipmodel.num_nz,
+                    'description': description}
+        with open(self.path(key, '.json'), 'w') as file:
+            json.dump(metadata, file, indent=1)
+
+    def load(self, key, solver_name='GRB'):
+        #returns (mipmodel, {name: list of variables}, block_registry) or None if key is not cached
+        if not self.contains(key):
+            return(None)
+        with open(self.path(key, '.json')) as file:
+            metadata = json.load(file)
+        columns = np.load(self.path(key, '.npz'))
+        mipmodel = Model(sense=metadata['sense'], solver_name=solver_name)
+        with tempfile.TemporaryDirectory() as directory:
+            mps_path = os.path.join(directory, 'model.mps')
+            with gzip.open(self.path(key, '.mps.gz'), 'rb') as source, open(mps_path, 'wb') as target:
+                shutil.copyfileobj(source, target)
+            mipmodel.read(mps_path)
+        #an entry that does not read back as it was written (written before rows were named) is built again
+        if (mipmodel.num_rows, mipmodel.num_cols, mipmodel.num_nz) != (metadata['num_rows'], metadata['num_cols'], metadata['num_nz']):
+            return(None)
+        #mps files do not keep the objective sense reliably, restore it from the stored coefficients
+        all_vars = list(mipmodel.vars)
+        if 'var_types' not in columns:
+            return(None)
+        for var, var_type, (lb, ub) in zip(all_vars, columns['var_types'], columns['var_bounds']):
+            if var.var_type != var_type:
+                var.var_type = str(var_type)
+                var.lb, var.ub = lb, ub
+        objective = LinExpr(variables=[all_vars[col] for col in columns['objective_cols']],
+                            coeffs=columns['objective_coeffs'].tolist())
+        mipmodel.sense = metadata['sense']
+        mipmodel.objective = maximize(objective) if metadata['sense'] == MAXIMIZE else minimize(objective)
+        variables = {}
+        start = 0
+        for name, count in metadata['variables']:
+            variables[name] = all_vars[start:start + count]
+            start += count
+        blocks = block_registry.from_rows(mipmodel, {name: columns['block_' + name] for name in metadata.get('blocks', [])})
+        return(mipmodel, variables, blocks)
+
+    def cached(self, key, owner, build, variable_names, solver_name='GRB'):
+        #sets owner.mipmodel, owner.blocks and owner.<variable_names> from the cache, or calls build() and stores what it built
+        loaded = self.load(key, solver_name)
+        if loaded is None:
+            build()
+            self.store(key, owner.mipmodel, {name: getattr(owner, name) for name in variable_names}, build.__name__,
+                       getattr(owner, 'blocks', None))
+            return(False)
+        owner.mipmodel, variables, owner.blocks = loaded
+        for name in variable_names:
+            setattr(owner, name, variables[name])
+        return(True)
@@ -0,0 +1,89 @@
+import importlib.util
+import inspect
+import logging
+import os
+
+from model_builder import model_builder
+from model_cache import MODEL_PARAMETERS
+from tag_index import tag_index
+from dominance import prune_recipes
+from recipe_store import load_recipes
+from solver_backend import solver_backend
+from progress_events import event_stream
+
+#keyword arguments of the model classes that only set how the model is solved
+SOLVER_SETTINGS = ('threads', 'max_seconds', 'max_mip_gap')
+#model scripts by name, loaded from file because model-1..model-3 are not importable module names
+MODELS = {'model_1': 'model-1.py', 'model_2': 'model-2.py', 'model_3': 'model-3.py', 'model_4': 'model_4.py'}
+
+
+def load_model_class(model_name):
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), MODELS[model_name])
+    spec = importlib.util.spec_from_file_location(model_name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return(getattr(module, model_name))
+
+
+def model_owner(model_name, data_path, parameters):
+    #an instance of the model class with the attributes its __init__ would set, but nothing built or solved
+    model_class = load_model_class(model_name)
+    defaults = {name: parameter.default for name, parameter in inspect.signature(model_class.__init__).parameters.items()
+                if parameter.default is not inspect.Parameter.empty}
+    defaults.update(parameters)
+    owner = model_class.__new__(model_class)
+    for name in MODEL_PARAMETERS:
+        if name in defaults:
+            setattr(owner, name, defaults[name])
+    #model_4 derives profit from its root relaxation, the rhs does not change what is built
+    owner.profit = defaults.get('profit', 0.0)
+    owner.recipes_df, owner.tag_tokens = load_recipes(data_path, defaults.get('cache_directory', 'model_cache'), tokens=True)
+    return(owner)
+
+
+def prepare_recipes(owner):
+    #tag index of owner.recipes_df from the stored tag tokens, then the dominance pruning with prune_dominated;
+    #the vocabulary of fused tokens is learned before pruning and kept for the rest
+    owner.tags = tag_index(owner.recipes_df, owner.tag_matching, owner.tag_tokens)
+    if getattr(owner, 'prune_dominated', False):
+        owner.recipes_df, owner.pruning = prune_recipes(owner.recipes_df, owner.n_assigned, owner.target_tags, owner.repetition_interval, owner.tags)
+        owner.tags = owner.tags.subset(owner.recipes_df['ix'].to_numpy())
+        print('dominance pruning removed {} of {} recipes ({} columns)'.format(
+            owner.pruning['removed'], owner.pruning['recipes'], owner.pruning['removed'] * owner.period_number))
+
+
+def prepared_model(model_name, data_path, parameters):
+    #model_owner with the recipe data prepared as in __init__ (pruning, tags, expansion, robust columns, builder), nothing built
+    owner = model_owner(model_name, data_path, parameters)
+    prepare_recipes(owner)
+    owner.expansion = owner.prepare_df(owner.recipes_df, owner.period_number)
+    if hasattr(owner, 'robust_variables'):
+        owner.recipes_df = owner.robust_variables(owner.recipes_df, 1, owner.deviation_percentage)
+    owner.period_list = owner.expansion.period_list
+    owner.builder = model_builder(owner.expansion, owner.n_assigned, owner.tags)
+    return(owner)
+
+
+def setup_model(owner, arguments):
+    #the start of every model class's __init__, arguments: its keyword arguments (locals() at the top of __init__)
+    #sets the model parameters and solver settings as attributes, opens the progress events (to the jsonl file events,
+    #None for none, and event_callback(event)) and the solver backend, then loads the recipes from the columnar store
+    #of the csv (parsed only the first time the file is seen) and prepares them (prepare_recipes)
+    #the rest of __init__ runs inside 'with owner.events:', so the events file is closed when __init__ ends
+    owner.logger = logging.getLogger('miplog')
+    for name in MODEL_PARAMETERS + SOLVER_SETTINGS:
+        if name in arguments:
+            setattr(owner, name, arguments[name])
+    owner.events = event_stream(arguments['events'], arguments['event_callback'])
+    try:
+        owner.backend = solver_backend(arguments['solver'], owner.threads, owner.max_seconds, owner.max_mip_gap, events=owner.events)
+        #rows separated lazily need Gurobi's lazy constraint callback (see solver_backend.require_lazy_callback)
+        if owner.lazy_rows:
+            owner.backend.require_lazy_callback('lazy_rows')
+        if getattr(owner, 'robust_formulation', None) == 'cuts':
+            owner.backend.require_lazy_callback("robust_formulation='cuts'")
+        owner.recipes_df, owner.tag_tokens = load_recipes(arguments['data_path'], arguments['cache_directory'], tokens=True)
+        prepare_recipes(owner)
+    except BaseException:
+        owner.events.close()
+        raise
@@ -0,0 +1,158 @@
+import argparse
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+from mip import MAXIMIZE, BINARY, CONTINUOUS
+from model_builder import load_blocks
+from solver_backend import solver_backend
+from model_setup import prepared_model
+
+
+def frontier_blocks(owner, profit, target_rating=None):
+    #rows of one frontier point: every family of model_4's model with profit as constraint_6_profit rhs
+    #(no profit row for None), plus the robust rating rows (compact) when target_rating is given
+    builder = owner.builder
+    blocks = [builder.repetition(owner.repetition_interval),
+              builder.assignment(owner.n_assigned),
+              builder.nutrient('constraint_3', 'calories', owner.target_calorie),
+              builder.nutrient('constraint_4', 'protein', owner.target_protein),
+              builder.nutrient('constraint_5', 'fat', owner.target_fat),
+              builder.seasonal('constraint_7', [12, 1, 2], 'summer'),
+              builder.seasonal('constraint_8', [6, 7, 8], 'winter'),
+              builder.tag_cap(owner.target_tags)]
+    if profit is not None:
+        blocks.append(builder.profit(profit))
+    if target_rating is not None:
+        blocks += builder.robust_rating_rows(target_rating, owner.r, 'compact')
+    return(blocks)
+
+
+def frontier_model(backend, owner, profit, target_rating=None, var_type=BINARY, objective='rating'):
+    #(mipmodel, xij) maximizing the average of objective per assigned recipe
+    builder = owner.builder
+    mipmodel = backend.model(MAXIMIZE)
+    xij = builder.add_variables(mipmodel, 'x', var_type)
+    variables = list(xij)
+    if target_rating is not None:
+        zij, wj = builder.add_robust_variables(mipmodel, 'compact')
+        variables += zij + wj
+    mipmodel.objective = builder.objective(xij, objective)
+    load_blocks(mipmodel, variables, frontier_blocks(owner, profit, target_rating))
+    return(mipmodel, xij)
+
+
+def profit_bound(owner, target_rating=None, solver_name='CBC'):
+    #largest average profit of any plan: the linear relaxation of the profit model without a profit row
+    backend = solver_backend(solver_name, max_mip_gap=0.0)
+    mipmodel, xij = frontier_model(backend, owner, None, target_rating, CONTINUOUS, 'profit')
+    result = backend.optimize(mipmodel)
+    if not result.has_solution:
+        raise RuntimeError('the profit relaxation has no solution ({})'.format(result.status.name))
+    return(result.objective_bound)
+
+
+def solve_chain(model_name, data_path, parameters, target_rating, profits, solver_name, threads, max_seconds, max_mip_gap):
+    #solves the points of one robust rating target for decreasing profit thresholds in a worker process;
+    #a plan for a higher threshold is feasible for every lower one, so each point starts from the previous plan
+    owner = prepared_model(model_name, data_path, parameters)
+    builder = owner.builder
+    backend = solver_backend(solver_name, threads, max_seconds, max_mip_gap)
+    profit_values = builder.values('profit') / (owner.n_assigned * builder.n_periods)
+    rating_values = builder.values('rating') / (owner.n_assigned * builder.n_periods)
+    points = []
+    start_columns = None
+    for profit in sorted(profits, reverse=True):
+        started = time.time()
+        #a fresh model per point: CBC keeps the cutoff of its last solve when a rhs changes
+        mipmodel, xij = frontier_model(backend, owner, profit, target_rating)
+        start = None
+        if start_columns is not None:
+            start = [(xij[col], 1.0) for col in start_columns]
+            if target_rating is not None:
+                values = np.zeros(builder.n_x)
+                values[start_columns] = 1.0
+                z, w = builder.robust_values(values, owner.r)
+                variables = mipmodel.vars
+                start += [(variables[builder.n_x + col], z[col]) for col in np.flatnonzero(z)]
+                start += [(variables[2 * builder.n_x + period_pos], w[period_pos]) for period_pos in np.flatnonzero(w)]
+        result = backend.optimize(mipmodel, start)
+        point = {'target_rating': target_rating, 'profit_threshold': profit, 'seconds': time.time() - started,
+                 'warm_start': start is not None, **result.summary()}
+        if result.has_solution:
+            start_columns = builder.selected_columns(result.values_of(xij))
+            point.update(rating=float(rating_values[start_columns].sum()), profit=float(profit_values[start_columns].sum()),
+                         selected_columns=start_columns.tolist())
+        points.append(point)
+    return(points)
+
+
+def pareto_front(frontier):
+    #marks the points of one series no other point beats in both average rating and average profit
+    solved = frontier.dropna(subset=['rating', 'profit'])
+    front = pd.Series(False, index=frontier.index)
+    for index, row in solved.iterrows():
+        better = (solved['rating'] >= row['rating']) & (solved['profit'] >= row['profit']) & \
+                 ((solved['rating'] > row['rating']) | (solved['profit'] > row['profit']))
+        front[index] = not better.any()
+    return(front)
+
+
+def run_frontier(model_name, data_path, parameters, profits, target_ratings=(None,), jobs=1, solver_name='CBC',
+                 threads=1, max_seconds=600, max_mip_gap=1e-4, segments=None):
+    #epsilon-constraint frontier of rating over the profit thresholds, one series per robust rating target
+    #every series is split into segments contiguous chains of thresholds (default: enough to keep jobs workers busy)
+    if segments is None:
+        segments = max(1, jobs // len(target_ratings))
+    profits = sorted(profits, reverse=True)
+    chains = [(target_rating, list(part)) for target_rating in target_ratings
+              for part in np.array_split(profits, min(segments, len(profits))) if len(part)]
+    points = []
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = [pool.submit(solve_chain, model_name, data_path, parameters, target_rating, chain,
+                               solver_name, threads, max_seconds, max_mip_gap) for target_rating, chain in chains]
+        for future in as_completed(futures):
+            for point in future.result():
+                print('rating target {}, profit >= {:.4f}: {} {}'.format(
+                    point['target_rating'], point['profit_threshold'], point['status'], point.get('rating')))
+                points.append(point)
+    frontier = pd.DataFrame(points)
+    for column in ('rating', 'profit', 'objective_bound', 'gap'):
+        if column not in frontier:
+            frontier[column] = np.nan
+    frontier = frontier.sort_values(['target_rating', 'profit_threshold'], na_position='first').reset_index(drop=True)
+    frontier['pareto'] = False
+    for target_rating, series in frontier.groupby('target_rating', dropna=False):
+        frontier.loc[series.index, 'pareto'] = pareto_front(series)
+    return(frontier)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='epsilon-constraint frontier of average rating against profit thresholds')
+    parser.add_argument('model', nargs='?', default='model_4')
+    parser.add_argument('--parameters', default='{}', help='json object of model parameters')
+    parser.add_argument('--data', default='cleaned_db.csv')
+    parser.add_argument('--profits', type=float, nargs='*', help='profit thresholds (average per assigned recipe)')
+    parser.add_argument('--fractions', type=float, nargs='*', default=list(np.linspace(0.5, 0.95, 10)),
+                        help='thresholds as fractions of the relaxed profit bound, used without --profits')
+    parser.add_argument('--ratings', nargs='*', default=['none'], help='robust rating targets, none for no robust rows')
+    parser.add_argument('--jobs', type=int, default=1)
+    parser.add_argument('--threads', type=int, default=1, help='threads per solve')
+    parser.add_argument('--solver', default='CBC')
+    parser.add_argument('--max-seconds', type=float, default=600, help='per point')
+    parser.add_argument('--max-mip-gap', type=float, default=1e-4)
+    parser.add_argument('--output', default='frontier')
+    args = parser.parse_args()
+    parameters = json.loads(args.parameters)
+    target_ratings = [None if rating == 'none' else float(rating) for rating in args.ratings]
+    profits = args.profits
+    if not profits:
+        bound = profit_bound(prepared_model(args.model, args.data, parameters), solver_name=args.solver)
+        profits = [fraction * bound for fraction in args.fractions]
+    frontier = run_frontier(args.model, args.data, parameters, profits, target_ratings, args.jobs, args.solver,
+                            args.threads, args.max_seconds, args.max_mip_gap)
+    frontier.to_json(args.output + '.json', orient='records', indent=1)
+    frontier.drop(columns=['selected_columns'], errors='ignore').to_csv(args.output + '.csv', index=False)
+    print(frontier.drop(columns=['selected_columns'], errors='ignore').to_string(index=False))
@@ -0,0 +1,105 @@
+import hashlib
+
+import numpy as np
+import pandas as pd
+from tag_index import tag_index
+
+#(periods, tag) of the seasonal rules of constraint_7 and constraint_8: recipes matching tag are not served in periods
+SEASONAL_RULES = (([12, 1, 2], 'summer'), ([6, 7, 8], 'winter'))
+
+
+def available_pairs(recipes_df, period_list, rules=(), tags=None):
+    #(period position x recipe position) mask of the pairs that get a column
+    #rules: (periods, recipes) pairs, recipes is a boolean mask over recipes_df or a tag matched like constraint_7;
+    #the recipes are unavailable in those periods (seasons, supplier calendars, holidays)
+    #tags: the tag_index tags are matched with, one of recipes_df when not given
+    period_list = np.asarray(period_list)
+    available = np.ones((len(period_list), len(recipes_df)), dtype=bool)
+    for periods, recipes in rules:
+        if isinstance(recipes, str):
+            if tags is None:
+                tags = tag_index(recipes_df)
+            recipes = tags.any_of(recipes)[tags.rows(recipes_df['ix'].to_numpy())]
+        available[np.ix_(np.isin(period_list, periods), np.asarray(recipes, dtype=bool))] = False
+    return(available)
+
+
+class period_expansion():
+    #recipe table expanded over the planning periods without copying it
+    #column k of the model is the pair (recipe_pos[k], period_pos[k]); columns are laid out period-major
+    #like the old prepare_df frame, so column = period_pos * n_recipes + recipe_pos when every pair is available
+    #available: optional mask from available_pairs, unavailable pairs get no column at all
+    def __init__(self, recipes_df, period_list, available=None):
+        self.recipes_df = recipes_df
+        self.period_list = np.asarray(period_list)
+        self.recipe_ids = recipes_df['ix'].to_numpy()
+        self.n_recipes = len(recipes_df)
+        self.n_periods = len(self.period_list)
+        if available is not None and available.all():
+            available = None
+        self.available = available
+        if available is None:
+            self.n_cols = self.n_recipes * self.n_periods
+            self.period_pos = np.repeat(np.arange(self.n_periods), self.n_recipes)
+            self.recipe_pos = np.tile(np.arange(self.n_recipes), self.n_periods)
+        else:
+            self.period_pos, self.recipe_pos = np.nonzero(available)
+            self.n_cols = len(self.period_pos)
+            self.grid = np.full(available.shape, -1, dtype=np.int64)
+            self.grid[self.period_pos, self.recipe_pos] = np.arange(self.n_cols)
+
+    @property
+    def n_removed(self):
+        #pairs without a column
+        return(self.n_recipes * self.n_periods - self.n_cols)
+
+    def column(self, recipe_pos, period_pos):
+        #column of the pair, -1 for unavailable pairs
+        if self.available is None:
+            return(np.asarray(period_pos) * self.n_recipes + np.asarray(recipe_pos))
+        return(self.grid[period_pos, recipe_pos])
+
+    def periods(self, first, length):
+        #the expansion of periods first..first+length-1 (positions), with the same available pairs
+        available = None if self.available is None else self.available[first:first + length]
+        return(period_expansion(self.recipes_df, self.period_list[first:first + length], available))
+
+    def fingerprint(self):
+        #hash of the column layout, models built on different layouts must not share a cache entry
+        digest = hashlib.sha256(self.period_list.tobytes())
+        digest.update(str(self.n_recipes).encode())
+        if self.available is not None:
+            digest.update(np.packbits(self.available).tobytes())
+        return(digest.hexdigest())
+
+    def period_of(self, columns):
+        return(self.period_list[self.period_pos[columns]])
+
+    def recipe_of(self, columns):
+        return(self.recipe_ids[self.recipe_pos[columns]])
+
+    def values(self, column_name):
+        #per-column values of a recipe attribute
+        return(self.recipes_df[column_name].to_numpy()[self.recipe_pos])
+
+    def columns_in(self, period):
+        period_pos = np.flatnonzero(self.period_list == period)[0]
+        return(np.flatnonzero(self.period_pos == period_pos))
+
+    def dec_var(self, col):
+        #name of the decision variable of a column, 'ix,period'
+        return('{},{}'.format(self.recipe_ids[self.recipe_pos[col]], self.period_list[self.period_pos[col]]))
+
+    def frame(self, columns=None):
+        #materializes the expanded rows of the given columns (all of them if None), indexed by column
+        if columns is None:
+            columns = np.arange(self.n_cols)
+        columns = np.asarray(columns, dtype=np.int64)
+        frame_df = self.recipes_df.iloc[self.recipe_pos[columns]].copy()
+        frame_df['dec_var'] = [self.dec_var(col) for col in columns]
+        frame_df['period'] = self.period_list[self.period_pos[columns]]
+        frame_df.index = columns
+        return(frame_df)
+
+    def period_view(self, period):
+        return(self.frame(self.columns_in(period)))
@@ -0,0 +1,92 @@
+import json
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+
+def model_size(mipmodel):
+    #rows, columns and nonzeros of a python-mip model, None for no model
+    if mipmodel is None:
+        return({'rows': None, 'cols': None, 'nonzeros': None})
+    return({'rows': mipmodel.num_rows, 'cols': mipmodel.num_cols, 'nonzeros': mipmodel.num_nz})
+
+
+def plain(value):
+    #json value of numpy scalars, infinite bounds become null
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and not np.isfinite(value):
+        return(None)
+    return(value)
+
+
+class event_stream():
+    #structured progress of a model run, one json object per line of path and per call of callback(event)
+    #every event has the unix time, the seconds since the stream was opened, the phase (prepare, build,
+    #root_relaxation, mip, warm_start, ...), what happened (start, progress, end) and the size of the model;
+    #the events of a solve also carry incumbent, bound, gap and node count where the solver reports them;
+    #nothing is emitted while a solve runs: its search progress (Gurobi only) is replayed as progress events
+    #after the solve returns, right before its end event (see solved)
+    #a phase or solve that raises ends with an end event with status 'error' and the exception
+    #the stream is a context manager, leaving it closes the file (close)
+    def __init__(self, path='events.jsonl', callback=None):
+        self.path = path
+        self.callback = callback
+        self.opened = time.time()
+        self.file = open(path, 'a') if path else None
+
+    def emit(self, phase, event, mipmodel=None, result=None, **fields):
+        now = time.time()
+        record = {'time': now, 'elapsed': now - self.opened, 'phase': phase, 'event': event, **model_size(mipmodel)}
+        if result is not None:
+            record.update(status=result.status.name, incumbent=result.objective_value, bound=result.objective_bound,
+                          gap=result.gap, nodes=result.nodes)
+        record.update(fields)
+        record = {name: plain(value) for name, value in record.items()}
+        if self.file is not None:
+            self.file.write(json.dumps(record) + '\n')
+            #flushed at once, so a long solve can be followed with tail -f
+            self.file.flush()
+        if self.callback is not None:
+            self.callback(record)
+        return(record)
+
+    @contextmanager
+    def phase(self, name, owner, **fields):
+        #start and end events around a phase that builds or changes owner.mipmodel
+        started = time.time()
+        self.emit(name, 'start', getattr(owner, 'mipmodel', None), **fields)
+        error = {}
+        try:
+            yield
+        except BaseException as exception:
+            error = {'status': 'error', 'error': repr(exception)}
+            raise
+        finally:
+            self.emit(name, 'end', getattr(owner, 'mipmodel', None), seconds=time.time() - started, **error, **fields)
+
+    def solved(self, phase, mipmodel, result, seconds, progress=()):
+        #the events of one finished solve: the (seconds, (lower bound, upper bound)) points of the solver's
+        #search progress log first, then the end event with the result; called once the solve has returned,
+        #so the progress events all arrive at its end
+        for offset, (lower, upper) in progress:
+            self.emit(phase, 'progress', mipmodel, solve_seconds=offset, lower_bound=lower, upper_bound=upper)
+        return(self.emit(phase, 'end', mipmodel, result, seconds=seconds))
+
+    def error(self, phase, mipmodel, seconds, exception):
+        #the end event of a solve that raised
+        return(self.emit(phase, 'end', mipmodel, seconds=seconds, status='error', error=repr(exception)))
+
+    def close(self):
+        #closes the file, later events only go to the callback
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def __enter__(self):
+        return(self)
+
+    def __exit__(self, exception_type, exception, traceback):
+        self.close()
+        return(False)
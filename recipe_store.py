@@ -0,0 +1,150 @@
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+from tag_index import tag_tokens
+
+#bumped when the layout of a store changes, stores of another version are built again
+STORE_VERSION = 3
+#text columns stored dictionary encoded (codes + categories) and loaded as categoricals
+CATEGORICAL_COLUMNS = ('title', 'tags')
+
+
+def file_hash(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            digest.update(chunk)
+    return(digest.hexdigest())
+
+
+def write_strings(strings, path):
+    #a list of strings as one NUL separated utf-8 file, read back with a single split (much faster than json)
+    with open(path, 'wb') as file:
+        file.write('\0'.join(strings).encode())
+
+
+def read_strings(path):
+    with open(path, 'rb') as file:
+        text = file.read().decode()
+    return(text.split('\0') if text else [])
+
+
+def write_store(recipes_df, directory, source=None, digest=None):
+    #writes recipes_df into directory: one .npy per numeric column, codes .npy plus categories per
+    #categorical column, the tag tokens of every recipe as a csr layout (see tag_tokens), and meta.json
+    #with the column order and dtypes
+    os.makedirs(directory, exist_ok=True)
+    columns = []
+    for column in recipes_df.columns:
+        values = recipes_df[column]
+        if column in CATEGORICAL_COLUMNS or not pd.api.types.is_numeric_dtype(values):
+            #categories in order of first appearance, sorting a million titles costs more than the whole rest
+            #missing values keep code -1 and are read back as NaN
+            codes, categories = pd.factorize(values, sort=False)
+            np.save(os.path.join(directory, column + '.codes.npy'), codes.astype(np.int32))
+            write_strings([str(category) for category in categories], os.path.join(directory, column + '.categories'))
+            columns.append({'name': column, 'kind': 'categorical'})
+        else:
+            np.save(os.path.join(directory, column + '.npy'), values.to_numpy())
+            columns.append({'name': column, 'kind': 'numeric', 'dtype': str(values.dtype)})
+    if 'tags' in recipes_df:
+        #whole tags strings are nearly unique per recipe, their tokens are what tag_index works on
+        vocabulary, indptr, indices = tag_tokens(recipes_df['tags'].tolist())
+        np.save(os.path.join(directory, 'tag_tokens.indptr.npy'), indptr)
+        np.save(os.path.join(directory, 'tag_tokens.indices.npy'), indices)
+        write_strings(vocabulary, os.path.join(directory, 'tag_tokens.vocabulary'))
+    meta = {'version': STORE_VERSION, 'rows': len(recipes_df), 'columns': columns, 'source': source, 'hash': digest,
+            'created': time.time()}
+    with open(os.path.join(directory, 'meta.json'), 'w') as file:
+        json.dump(meta, file, indent=1)
+    return(meta)
+
+
+def read_store(directory):
+    #the recipe table of a store: numeric columns are copy-on-write memory maps of their .npy files,
+    #categorical columns are built from their codes (also memory mapped) and categories
+    with open(os.path.join(directory, 'meta.json')) as file:
+        meta = json.load(file)
+    data = {}
+    for column in meta['columns']:
+        name = column['name']
+        if column['kind'] == 'numeric':
+            data[name] = np.load(os.path.join(directory, name + '.npy'), mmap_mode='c')
+        else:
+            categories = read_strings(os.path.join(directory, name + '.categories'))
+            codes = np.load(os.path.join(directory, name + '.codes.npy'), mmap_mode='c')
+            #the codes were written by pd.factorize (-1 for a missing value), checking them again would cost a pass over every row
+            data[name] = pd.Categorical.from_codes(codes, categories=categories, validate=False)
+    return(pd.DataFrame(data, copy=False))
+
+
+def read_tag_tokens(directory):
+    #(vocabulary, indptr, indices) of a store's tags, memory mapped, None for a table without tags
+    if not os.path.exists(os.path.join(directory, 'tag_tokens.vocabulary')):
+        return(None)
+    return(read_strings(os.path.join(directory, 'tag_tokens.vocabulary')),
+           np.load(os.path.join(directory, 'tag_tokens.indptr.npy'), mmap_mode='r'),
+           np.load(os.path.join(directory, 'tag_tokens.indices.npy'), mmap_mode='r'))
+
+
+class recipe_store():
+    #converts recipe csv files once into columnar stores under directory, one per content hash, so copies of the
+    #same csv share a store and an edited csv gets a new one
+    def __init__(self, directory='model_cache/recipes'):
+        self.directory = directory
+
+    def path(self, digest):
+        return(os.path.join(self.directory, digest))
+
+    def store_of(self, data_path):
+        #the store directory of data_path, written first if it does not exist yet
+        digest = file_hash(data_path)
+        path = self.path(digest)
+        meta_path = os.path.join(path, 'meta.json')
+        if os.path.exists(meta_path):
+            with open(meta_path) as file:
+                if json.load(file).get('version') == STORE_VERSION:
+                    return(path)
+            shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(self.directory, exist_ok=True)
+        #written next to its place and renamed, parallel runs (sweep jobs) never see half a store
+        partial = tempfile.mkdtemp(prefix=digest + '.', dir=self.directory)
+        write_store(pd.read_csv(data_path), partial, os.path.abspath(data_path), digest)
+        try:
+            os.rename(partial, path)
+        except OSError:
+            #another process renamed its copy first
+            shutil.rmtree(partial, ignore_errors=True)
+        return(path)
+
+    def load(self, data_path, tokens=False):
+        #the recipe table, with tokens also the tag tokens of its recipes (read_tag_tokens)
+        path = self.store_of(data_path)
+        if tokens:
+            return(read_store(path), read_tag_tokens(path))
+        return(read_store(path))
+
+
+def load_recipes(data_path, cache_directory='model_cache', tokens=False):
+    #the recipe table of a csv file from its columnar store under cache_directory/recipes,
+    #with tokens a (recipe table, tag tokens) pair for tag_index
+    return(recipe_store(os.path.join(cache_directory, 'recipes')).load(data_path, tokens))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='convert recipe csv files into columnar stores')
+    parser.add_argument('data', nargs='+')
+    parser.add_argument('--cache', default='model_cache')
+    args = parser.parse_args()
+    store = recipe_store(os.path.join(args.cache, 'recipes'))
+    for data_path in args.data:
+        started = time.time()
+        path = store.store_of(data_path)
+        print('{}: {} ({:.2f}s)'.format(data_path, path, time.time() - started))
@@ -0,0 +1,138 @@
+import argparse
+import copy
+import json
+import time
+
+import numpy as np
+from mip import MAXIMIZE, BINARY, CONTINUOUS
+from model_builder import model_builder, load_blocks
+from lagrangian import model_blocks
+from solver_backend import solver_backend
+from model_setup import prepared_model
+
+
+class rolling_horizon():
+    #solves the periods of a prepared model in windows of window periods, keeps the first fix periods of every
+    #window and slides on; recipes kept in the last repetition_interval periods are forbidden at the start of
+    #the next window, which is what the constraint_1 rows across the window boundary would do
+    def __init__(self, owner, robust=False, profit=None, solver_name='CBC', threads=0, max_seconds=600, max_mip_gap=1e-4):
+        self.owner = owner
+        self.robust = robust
+        self.profit = profit
+        self.backend = solver_backend(solver_name, threads, max_seconds, max_mip_gap)
+        self.expansion = owner.expansion
+        self.period_list = owner.expansion.period_list
+
+    def window_owner(self, first, length):
+        #the prepared model restricted to periods first..first+length-1
+        window = copy.copy(self.owner)
+        window.expansion = self.expansion.periods(first, length)
+        window.period_list = window.expansion.period_list
+        window.builder = model_builder(window.expansion, self.owner.n_assigned, self.owner.tags)
+        return(window)
+
+    def solve_window(self, first, length, used):
+        #solves one window, used: {period position: recipe positions kept there}
+        #returns (solve_result, the window's period_expansion, its xij values)
+        window = self.window_owner(first, length)
+        builder = window.builder
+        mipmodel = self.backend.model(MAXIMIZE)
+        xij = builder.add_variables(mipmodel, 'x', BINARY)
+        variables = list(xij)
+        if self.robust:
+            variables += builder.add_variables(mipmodel, 'z', CONTINUOUS)
+            variables += builder.add_variables(mipmodel, 'w', CONTINUOUS, builder.n_periods)
+        mipmodel.objective = builder.objective(xij, 'profit')
+        blocks = [builder.repetition(self.owner.repetition_interval)] + model_blocks(window, self.robust, self.profit)
+        load_blocks(mipmodel, variables, blocks)
+        for period_pos, recipes in used.items():
+            for offset in range(1, self.owner.repetition_interval + 1):
+                if first <= period_pos + offset < first + length:
+                    for col in window.expansion.column(recipes, period_pos + offset - first):
+                        if col >= 0:
+                            xij[col].ub = 0.0
+        result = self.backend.optimize(mipmodel)
+        if not result.has_solution:
+            raise RuntimeError('window of periods {} has no solution ({})'.format(
+                list(self.period_list[first:first + length]), result.status.name))
+        return(result, window.expansion, result.values_of(xij))
+
+    def solve(self, window=4, fix=1):
+        #returns the selected columns of the full expansion and a report per window
+        if not 1 <= fix <= window:
+            raise ValueError('fix must be between 1 and window')
+        n_periods = len(self.period_list)
+        used = {}
+        windows = []
+        first = 0
+        while first < n_periods:
+            length = min(window, n_periods - first)
+            start = time.time()
+            result, expansion, values = self.solve_window(first, length, used)
+            #the last window keeps everything it planned
+            kept = length if first + length == n_periods else fix
+            for period_pos in range(kept):
+                used[first + period_pos] = expansion.recipe_pos[(values > 0.5) & (expansion.period_pos == period_pos)]
+            windows.append({'first_period': int(self.period_list[first]), 'periods': length, 'kept': kept,
+                            'seconds': time.time() - start, **result.summary()})
+            print('window {}..{}: {}, kept {} periods'.format(
+                self.period_list[first], self.period_list[first + length - 1], result.status.name, kept))
+            first += kept
+        selected = np.sort(np.concatenate([self.expansion.column(recipes, period_pos) for period_pos, recipes in used.items()]))
+        return(selected, windows)
+
+    def objective_value(self, selected):
+        #objective of the full model for a plan given by its selected columns
+        builder = self.owner.builder
+        return(float(builder.values('profit')[selected].sum() / (self.owner.n_assigned * builder.n_periods)))
+
+
+def compare_with_full(owner, window, fix, robust=False, **settings):
+    #rolling horizon against the monolithic model of the same periods (one window over the whole horizon)
+    #gap is measured against the full model's plan, bound_gap against its bound, which also holds when it stopped early
+    driver = rolling_horizon(owner, robust, **settings)
+    start = time.time()
+    selected, windows = driver.solve(window, fix)
+    rolling_seconds = time.time() - start
+    start = time.time()
+    full, full_windows = driver.solve(len(driver.period_list), len(driver.period_list))
+    full_seconds = time.time() - start
+    rolling_value = driver.objective_value(selected)
+    full_value = driver.objective_value(full)
+    full_bound = full_windows[0]['objective_bound']
+    return({'window': window, 'fix': fix, 'periods': len(driver.period_list),
+            'rolling_objective': rolling_value, 'rolling_seconds': rolling_seconds,
+            'full_objective': full_value, 'full_seconds': full_seconds, 'full_bound': full_bound,
+            'gap': (full_value - rolling_value) / max(abs(full_value), 1e-10),
+            'bound_gap': (full_bound - rolling_value) / max(abs(full_bound), 1e-10), 'windows': windows})
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='rolling horizon solve of a model over long planning horizons')
+    parser.add_argument('model', nargs='?', default='model_2')
+    parser.add_argument('--parameters', default='{}', help='json object of model parameters, e.g. \'{"period_number": 52}\'')
+    parser.add_argument('--robust', action='store_true', help='robust rating rows instead of the nominal ones')
+    parser.add_argument('--window', type=int, default=4)
+    parser.add_argument('--fix', type=int, default=1)
+    parser.add_argument('--data', default='cleaned_db.csv')
+    parser.add_argument('--solver', default='CBC')
+    parser.add_argument('--max-seconds', type=float, default=600, help='per window')
+    parser.add_argument('--compare', action='store_true', help='also solve the full model and report the gap')
+    parser.add_argument('--output', default='result_rolling')
+    args = parser.parse_args()
+    owner = prepared_model(args.model, args.data, json.loads(args.parameters))
+    settings = {'solver_name': args.solver, 'max_seconds': args.max_seconds}
+    if args.compare:
+        report = compare_with_full(owner, args.window, args.fix, args.robust, **settings)
+        with open(args.output + '.json', 'w') as file:
+            json.dump(report, file, indent=1)
+        print('rolling {:.6f} in {:.1f} s, full {:.6f} in {:.1f} s, gap {:.4%} (to the full bound {:.4%})'.format(
+            report['rolling_objective'], report['rolling_seconds'], report['full_objective'], report['full_seconds'],
+            report['gap'], report['bound_gap']))
+    else:
+        driver = rolling_horizon(owner, args.robust, **settings)
+        selected, windows = driver.solve(args.window, args.fix)
+        result_df = owner.expansion.frame(selected)
+        result_df.to_csv(args.output)
+        print('objective {}'.format(driver.objective_value(selected)))
+        print(result_df)
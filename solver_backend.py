@@ -0,0 +1,260 @@
+import gzip
+import os
+import re
+import subprocess
+import tempfile
+import time
+
+import numpy as np
+from mip import Model, MAXIMIZE, OptimizationStatus
+from model_builder import solution_values
+from model_cache import write_mps
+
+#solvers a model can be solved with; GRB and CBC run inside python-mip,
+#HIGHS hands the model to the HiGHS command line solver as an mps file
+SOLVERS = ('GRB', 'CBC', 'HIGHS')
+#solvers whose lazy constraint callback separates rows during the branch and bound search
+#(CBC cuts off better solutions through its callback, HiGHS has none)
+LAZY_SOLVERS = ('GRB',)
+#HiGHS 'Model status' lines that settle a solve, every other status means the search stopped early
+HIGHS_STATUS = {'Optimal': OptimizationStatus.OPTIMAL,
+                'Infeasible': OptimizationStatus.INFEASIBLE,
+                'Unbounded': OptimizationStatus.UNBOUNDED,
+                'Primal infeasible or unbounded': OptimizationStatus.INF_OR_UNBD}
+
+
+class solve_result():
+    #outcome of one solve, the same for every backend
+    #values[k] is the solution value of column k of the solved model (None without a solution)
+    #nodes: branch and bound nodes of the search, None where the solver does not report them (CBC)
+    def __init__(self, status, objective_value=None, objective_bound=None, values=None, nodes=None):
+        self.status = status
+        self.objective_value = objective_value
+        self.objective_bound = objective_bound
+        self.values = values
+        self.nodes = nodes
+
+    @property
+    def has_solution(self):
+        return(self.status in (OptimizationStatus.OPTIMAL, OptimizationStatus.FEASIBLE))
+
+    @property
+    def gap(self):
+        if self.objective_value is None or self.objective_bound is None:
+            return(None)
+        return(abs(self.objective_bound - self.objective_value) / max(abs(self.objective_value), 1e-10))
+
+    def values_of(self, variables):
+        return(self.values[np.fromiter((var.idx for var in variables), dtype=np.int64, count=len(variables))])
+
+    def summary(self):
+        summary = {'status': self.status.name}
+        if self.has_solution:
+            summary.update(objective_value=self.objective_value, objective_bound=self.objective_bound, gap=self.gap)
+        if self.nodes is not None:
+            summary['nodes'] = self.nodes
+        return(summary)
+
+
+class solver_backend():
+    #creates the models and solves them with the same settings on every solver:
+    #max_mip_gap relative gap, max_seconds time limit, threads (0 solver default, -1 all cores) and a warm start
+    #events: optional progress_events.event_stream, gets start and end events of every solve
+    def __init__(self, solver_name='GRB', threads=0, max_seconds=7200, max_mip_gap=0.01, highs_path='highs', events=None):
+        solver_name = solver_name.upper()
+        if solver_name == 'GUROBI':
+            solver_name = 'GRB'
+        if solver_name not in SOLVERS:
+            raise ValueError('unknown solver {}, expected one of {}'.format(solver_name, SOLVERS))
+        self.solver_name = solver_name
+        self.threads = threads
+        self.max_seconds = max_seconds
+        self.max_mip_gap = max_mip_gap
+        self.highs_path = highs_path
+        self.events = events
+
+    @property
+    def build_solver(self):
+        #python-mip solver that holds the model while it is built, HiGHS models are built in CBC and exported
+        return('CBC' if self.solver_name == 'HIGHS' else self.solver_name)
+
+    def model(self, sense=MAXIMIZE):
+        return(Model(sense=sense, solver_name=self.build_solver))
+
+    def require_lazy_callback(self, feature):
+        #rows left out of a MIP and separated lazily (lazy_rows, robust_formulation='cuts') need a solver in LAZY_SOLVERS;
+        #without a callback each round of rows is a solve of the whole MIP from scratch, many times slower than
+        #loading the rows and without a solution when the time limit ends the rounds
+        if self.solver_name not in LAZY_SOLVERS:
+            raise ValueError('{} needs a solver with a lazy constraint callback ({}), not {}'.format(
+                feature, ', '.join(LAZY_SOLVERS), self.solver_name))
+
+    def optimize(self, mipmodel, start=None, lazy_constrs=None, relax=False, phase='mip'):
+        #start: optional list of (variable, value) pairs, unlisted variables start at 0
+        #lazy_constrs: optional lazy_constraints, separated by Gurobi's lazy constraint callback in a MIP
+        #(see require_lazy_callback) and added in rounds of re-solves to a linear relaxation
+        #relax: solves the linear relaxation, the integer variables keep their type for later solves
+        #phase: name of the solve in the events
+        if lazy_constrs is None:
+            return(self.solve(mipmodel, start, self.max_seconds, relax, phase))
+        if mipmodel.num_int > 0 and not relax:
+            self.require_lazy_callback('lazy constraints')
+            mipmodel.lazy_constrs_generator = lazy_constrs
+            try:
+                return(self.solve(mipmodel, start, self.max_seconds, phase=phase))
+            finally:
+                #later solves of the model (lexicographic stages, callers) set their own generator
+                mipmodel.lazy_constrs_generator = None
+        deadline = time.time() + self.max_seconds
+        while True:
+            result = self.solve(mipmodel, start, max(deadline - time.time(), 1), relax, phase)
+            if not result.has_solution:
+                return(result)
+            rows = lazy_constrs.rows(lazy_constrs.xij, result.values_of(lazy_constrs.xij))
+            if not rows:
+                return(result)
+            if time.time() >= deadline:
+                #the last solution violates rows that were not added yet, only its bound is valid
+                return(solve_result(OptimizationStatus.NO_SOLUTION_FOUND, objective_bound=result.objective_bound))
+            for row in rows:
+                mipmodel.add_constr(row)
+
+    def lexicographic(self, mipmodel, stages, start=None, lazy_constrs=None, tolerance_name='lexicographic', phases=None):
+        #optimizes the objectives of stages one after the other on the same model, highest priority first
+        #stages: (objective, tolerance) pairs, objective a maximize/minimize LinExpr of mipmodel's variables;
+        #after its solve a stage with a tolerance keeps its objective within tolerance (relative) of the value
+        #found for the later stages as a row, None keeps no row and the stage only hands its incumbent on
+        #every stage starts from the previous stage's solution, the solver keeps its state between the solves
+        #returns the solve_result of every stage solved, the last one without a solution ends the sequence
+        #phases: optional event phase name of every stage
+        results = []
+        for position, (objective, tolerance) in enumerate(stages):
+            mipmodel.objective = objective
+            phase = phases[position] if phases else '{}_{}'.format(tolerance_name, position)
+            result = self.optimize(mipmodel, start, lazy_constrs, phase=phase)
+            results.append(result)
+            if not result.has_solution:
+                break
+            start = [(var, value) for var, value in zip(mipmodel.vars, result.values) if value != 0]
+            if tolerance is not None and position < len(stages) - 1:
+                slack = tolerance * abs(result.objective_value)
+                if mipmodel.sense == MAXIMIZE:
+                    row = objective >= result.objective_value - slack
+                else:
+                    row = objective <= result.objective_value + slack
+                mipmodel.add_constr(row, name='{}_{}'.format(tolerance_name, position))
+        return(results)
+
+    def solve(self, mipmodel, start, max_seconds, relax=False, phase='mip'):
+        started = time.time()
+        if self.events is not None:
+            self.events.emit(phase, 'start', mipmodel, relax=relax, warm_start=bool(start))
+        try:
+            if self.solver_name == 'HIGHS':
+                result = self.optimize_highs(mipmodel, start, max_seconds, relax)
+            else:
+                result = self.solve_mip(mipmodel, start, max_seconds, relax)
+        except BaseException as exception:
+            if self.events is not None:
+                self.events.error(phase, mipmodel, time.time() - started, exception)
+            raise
+        if self.events is not None:
+            progress = ()
+            if self.solver_name == 'GRB' and mipmodel.store_search_progress_log:
+                progress = mipmodel.search_progress_log.log
+            self.events.solved(phase, mipmodel, result, time.time() - started, progress)
+        return(result)
+
+    def solve_mip(self, mipmodel, start, max_seconds, relax):
+        #a solve inside python-mip (GRB, CBC)
+        mipmodel.max_mip_gap = self.max_mip_gap
+        mipmodel.threads = self.threads
+        if start and not relax:
+            mipmodel.start = start
+        #only Gurobi's search progress log is kept for the events, CBC's progress callback crashes some builds
+        if self.solver_name == 'GRB' and self.events is not None:
+            mipmodel.store_search_progress_log = True
+        status = mipmodel.optimize(max_seconds=max_seconds, relax=relax)
+        nodes = None
+        if self.solver_name == 'GRB' and mipmodel.num_int > 0 and not relax:
+            nodes = int(mipmodel.solver.get_dbl_attr('NodeCount'))
+        if status not in (OptimizationStatus.OPTIMAL, OptimizationStatus.FEASIBLE):
+            return(solve_result(status, objective_bound=mipmodel.objective_bound, nodes=nodes))
+        return(solve_result(status, mipmodel.objective_value, mipmodel.objective_bound, solution_values(mipmodel.vars), nodes))
+
+    def highs_options(self, max_seconds, relax=False):
+        options = {'mip_rel_gap': self.max_mip_gap, 'time_limit': float(max_seconds)}
+        if relax:
+            options['solve_relaxation'] = 'true'
+        if self.threads:
+            options['threads'] = os.cpu_count() if self.threads < 0 else self.threads
+        return(options)
+
+    def optimize_highs(self, mipmodel, start, max_seconds, relax=False):
+        with tempfile.TemporaryDirectory() as directory:
+            model_path = os.path.join(directory, 'model.mps')
+            write_highs_mps(mipmodel, model_path)
+            options_path = os.path.join(directory, 'options.txt')
+            with open(options_path, 'w') as file:
+                for name, value in self.highs_options(max_seconds, relax).items():
+                    file.write('{} = {}\n'.format(name, value))
+            solution_path = os.path.join(directory, 'solution.txt')
+            command = [self.highs_path, '--model_file', model_path, '--options_file', options_path,
+                       '--solution_file', solution_path]
+            if start and not relax:
+                start_path = os.path.join(directory, 'start.txt')
+                write_highs_start(mipmodel, start, start_path)
+                command += ['--read_solution_file', start_path]
+            #the solver log goes to our stdout like the in-process solvers' logs do
+            completed = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+            print(completed.stdout, end='')
+            if not os.path.exists(solution_path):
+                raise RuntimeError('highs exited with code {} without a solution file'.format(completed.returncode))
+            status, objective_value, values = read_highs_solution(solution_path, mipmodel.num_cols)
+        match = re.search(r'^\s*Dual bound\s+(\S+)', completed.stdout, re.MULTILINE)
+        objective_bound = float(match.group(1)) if match else objective_value
+        match = re.search(r'^\s*Nodes\s+(\d+)', completed.stdout, re.MULTILINE)
+        nodes = int(match.group(1)) if match else None
+        return(solve_result(status, objective_value, objective_bound, values, nodes))
+
+
+def write_highs_mps(mipmodel, path):
+    #mps file without compression and with an explicit OBJSENSE section, the files written by CBC leave it out
+    write_mps(mipmodel, path + '.gz')
+    with gzip.open(path + '.gz', 'rt') as source, open(path, 'w') as target:
+        for line in source:
+            if line.strip() == 'ROWS' and mipmodel.sense == MAXIMIZE:
+                target.write('OBJSENSE\n    MAX\n')
+            target.write(line)
+    os.remove(path + '.gz')
+
+
+def write_highs_start(mipmodel, start, path):
+    #a dense primal solution in HiGHS' raw solution format, columns in model order
+    values = np.zeros(mipmodel.num_cols)
+    for var, value in start:
+        values[var.idx] = value
+    with open(path, 'w') as file:
+        file.write('Model status\nUnknown\n\n# Primal solution values\nFeasible\nObjective 0\n')
+        file.write('# Columns {}\n'.format(mipmodel.num_cols))
+        for var, value in zip(mipmodel.vars, values):
+            file.write('{} {}\n'.format(var.name, value))
+
+
+def read_highs_solution(path, num_cols):
+    #returns (status, objective value, column values) of a raw HiGHS solution file
+    with open(path) as file:
+        lines = [line.rstrip('\n') for line in file]
+    model_status = lines[lines.index('Model status') + 1].strip()
+    primal = lines.index('# Primal solution values')
+    feasible = lines[primal + 1].strip() == 'Feasible'
+    status = HIGHS_STATUS.get(model_status)
+    if status is None:
+        #time or iteration limit, interrupted: whatever was found so far
+        status = OptimizationStatus.FEASIBLE if feasible else OptimizationStatus.NO_SOLUTION_FOUND
+    if not feasible or status != OptimizationStatus.OPTIMAL and status != OptimizationStatus.FEASIBLE:
+        return(status, None, None)
+    objective_value = float(lines[primal + 2].split()[1])
+    columns = lines.index('# Columns {}'.format(num_cols))
+    values = np.array([float(line.split()[-1]) for line in lines[columns + 1:columns + 1 + num_cols]])
+    return(status, objective_value, values)
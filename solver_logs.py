@@ -0,0 +1,344 @@
+import argparse
+import glob
+import json
+import os
+import re
+
+import pandas as pd
+
+#files of a run directory: the solver logs (results/ folders: mip_log, mip_log.log, mip_log_LOWCPU), the settings
+#(free text in results/, json from sweep.run_point) and the result csvs (result, result_model1 ...)
+LOG_PATTERN = 'mip_log*'
+SETTINGS_NAMES = ('settings', 'settings.txt')
+RESULT_PATTERN = 'result*'
+#gap of the time_to_gap column
+TARGET_GAP = 0.01
+#stored in the parse cache, a cache of another version is parsed again
+PARSER_VERSION = 2
+
+SOLVE_START = re.compile(r'^Gurobi Optimizer version (\S+)')
+PARAMETER = re.compile(r'^Set parameter (\w+) to value (\S+)')
+THREADS = re.compile(r'using up to (\d+) threads')
+MODEL_SIZE = re.compile(r'^Optimize a model with (\d+) rows, (\d+) columns and (\d+) nonzeros')
+VARIABLE_TYPES = re.compile(r'^Variable types: (\d+) continuous, (\d+) integer')
+PRESOLVE_REMOVED = re.compile(r'^Presolve removed (\d+) rows and (\d+) columns')
+PRESOLVE_TIME = re.compile(r'^Presolve time: ([\d.]+)s')
+PRESOLVED = re.compile(r'^Presolved: (\d+) rows, (\d+) columns, (\d+) nonzeros')
+MIP_START = re.compile(r'^Loaded user MIP start with objective (\S+)')
+HEURISTIC = re.compile(r'^Found heuristic solution: objective (\S+)')
+ROOT_RELAXATION = re.compile(r'^Root relaxation: objective (\S+), (\d+) iterations, ([\d.]+) seconds')
+NODE_HEADER = re.compile(r'^\s*Expl Unexpl')
+#a node table line: [H*] explored unexplored ... incumbent best bound gap it/node time
+NODE_LINE = re.compile(r'^[H* ]\s*\d+\s+\d+\s.*\s(\d+)s$')
+CUT = re.compile(r'^\s+([\w -]+): (\d+)$')
+EXPLORED = re.compile(r'^Explored (\d+) nodes \((\d+) simplex iterations\) in ([\d.]+) seconds(?: \(([\d.]+) work units\))?')
+LP_SOLVED = re.compile(r'^Solved in (\d+) iterations and ([\d.]+) seconds(?: \(([\d.]+) work units\))?')
+THREAD_COUNT = re.compile(r'^Thread count was (\d+)')
+SOLUTION_COUNT = re.compile(r'^Solution count (\d+)')
+BEST_OBJECTIVE = re.compile(r'^Best objective (\S+), best bound (\S+), gap (\S+)%')
+LP_OBJECTIVE = re.compile(r'^Optimal objective\s+(\S+)')
+STATUS_LINES = (('Optimal solution found', 'optimal'), ('Time limit reached', 'time_limit'),
+                ('Model is infeasible', 'infeasible'), ('Infeasible model', 'infeasible'),
+                ('Solve interrupted', 'interrupted'), ('Node limit reached', 'node_limit'),
+                ('Solution limit reached', 'solution_limit'))
+
+
+def number(text):
+    #float of a log field, None for '-' and the like
+    try:
+        return(float(text.rstrip('%')))
+    except ValueError:
+        return(None)
+
+
+def relative_gap(incumbent, bound):
+    if incumbent is None or bound is None:
+        return(None)
+    return(abs(bound - incumbent) / max(abs(incumbent), 1e-10))
+
+
+def time_to_gap(points, target, seconds=None, final_gap=None):
+    #first second of the node table with a gap of at most target; a solve that ends within target before
+    #its table shows it (small models, a single root node) counts with its total time
+    for time, incumbent, bound in points:
+        gap = relative_gap(incumbent, bound)
+        if gap is not None and gap <= target:
+            return(time)
+    if final_gap is not None and final_gap <= target:
+        return(seconds)
+    return(None)
+
+
+def primal_integral(points, seconds, reference):
+    #integral of the primal gap over the solve: 1 without an incumbent, |reference - incumbent| / max(|reference|,
+    #|incumbent|) after, reference the best objective known (the solve's own final objective by default)
+    if seconds is None or reference is None:
+        return(None)
+    integral = 0.0
+    gap = 1.0
+    last = 0.0
+    for time, incumbent, bound in points:
+        time = min(time, seconds)
+        integral += gap * (time - last)
+        last = time
+        if incumbent is not None:
+            scale = max(abs(reference), abs(incumbent))
+            gap = abs(reference - incumbent) / scale if scale > 0 else 0.0
+    return(integral + gap * (seconds - last))
+
+
+def parse_gurobi_log(text):
+    #one dict per Gurobi solve of a log: model size, presolve, root relaxation, nodes, cuts, status and result
+    #the (seconds, incumbent, bound) points of the node table go to 'points', incumbents found before it
+    #(MIP start, heuristics) count at the last second seen
+    solves = []
+    solve = None
+    parameters = {}
+    in_table = False
+    in_cuts = False
+    for line in text.splitlines():
+        line = line.rstrip()
+        match = PARAMETER.match(line)
+        if match:
+            parameters[match.group(1)] = match.group(2)
+            continue
+        match = SOLVE_START.match(line)
+        if match:
+            solve = {'gurobi_version': match.group(1), 'parameters': parameters, 'points': [], 'cuts': {}}
+            solves.append(solve)
+            parameters = {}
+            in_table = in_cuts = False
+            continue
+        if solve is None:
+            continue
+        if in_cuts:
+            match = CUT.match(line)
+            if match:
+                solve['cuts'][match.group(1).strip().lower().replace(' ', '_').replace('-', '_')] = int(match.group(2))
+                continue
+            in_cuts = False
+        if in_table:
+            match = NODE_LINE.match(line)
+            if match:
+                fields = line.split()
+                solve['points'].append((float(match.group(1)), number(fields[-5]), number(fields[-4])))
+                continue
+            if line.strip():
+                in_table = False
+        last_time = solve['points'][-1][0] if solve['points'] else 0.0
+        if NODE_HEADER.match(line):
+            in_table = True
+            solve['node_table'] = True
+        elif line.startswith('Cutting planes:'):
+            in_cuts = True
+        elif THREADS.search(line) and 'threads' not in solve:
+            solve['threads'] = int(THREADS.search(line).group(1))
+        elif MODEL_SIZE.match(line):
+            solve.update(zip(('rows', 'cols', 'nonzeros'), map(int, MODEL_SIZE.match(line).groups())))
+        elif VARIABLE_TYPES.match(line) and 'presolved_rows' not in solve:
+            solve.update(zip(('continuous', 'integer'), map(int, VARIABLE_TYPES.match(line).groups())))
+        elif PRESOLVE_REMOVED.match(line):
+            solve.update(zip(('presolve_removed_rows', 'presolve_removed_cols'), map(int, PRESOLVE_REMOVED.match(line).groups())))
+        elif PRESOLVE_TIME.match(line):
+            solve['presolve_seconds'] = float(PRESOLVE_TIME.match(line).group(1))
+        elif PRESOLVED.match(line):
+            solve.update(zip(('presolved_rows', 'presolved_cols', 'presolved_nonzeros'), map(int, PRESOLVED.match(line).groups())))
+        elif MIP_START.match(line):
+            solve['mip_start'] = number(MIP_START.match(line).group(1))
+            solve['points'].append((last_time, solve['mip_start'], None))
+        elif HEURISTIC.match(line):
+            solve['points'].append((last_time, number(HEURISTIC.match(line).group(1)), None))
+        elif ROOT_RELAXATION.match(line):
+            objective, iterations, seconds = ROOT_RELAXATION.match(line).groups()
+            solve.update(root_relaxation=number(objective), root_iterations=int(iterations), root_seconds=float(seconds))
+        elif EXPLORED.match(line):
+            nodes, iterations, seconds, work = EXPLORED.match(line).groups()
+            solve.update(nodes=int(nodes), iterations=int(iterations), seconds=float(seconds), work_units=number(work or ''), explored=True)
+        elif LP_SOLVED.match(line):
+            iterations, seconds, work = LP_SOLVED.match(line).groups()
+            solve.update(nodes=0, iterations=int(iterations), seconds=float(seconds), work_units=number(work or ''))
+        elif THREAD_COUNT.match(line):
+            solve['threads_used'] = int(THREAD_COUNT.match(line).group(1))
+        elif SOLUTION_COUNT.match(line):
+            solve['solution_count'] = int(SOLUTION_COUNT.match(line).group(1))
+        elif BEST_OBJECTIVE.match(line):
+            objective, bound, gap = BEST_OBJECTIVE.match(line).groups()
+            solve.update(objective=number(objective), bound=number(bound), gap=None if number(gap) is None else number(gap) / 100)
+        elif LP_OBJECTIVE.match(line):
+            solve['lp_objective'] = number(LP_OBJECTIVE.match(line).group(1))
+        else:
+            for prefix, status in STATUS_LINES:
+                if line.startswith(prefix):
+                    solve['status'] = status
+    for solve in solves:
+        #MIP logs print 'Optimal objective' for their root LP too, a solve is a linear program only without
+        #integer columns, node table and Explored line
+        objective = solve.pop('lp_objective', None)
+        node_table = solve.pop('node_table', False)
+        explored = solve.pop('explored', False)
+        if objective is not None and not solve.get('integer') and not node_table and not explored:
+            solve.update(objective=objective, bound=objective, gap=0.0, relaxation=True, status='optimal')
+    return(solves)
+
+
+def solve_metrics(solve, target_gap=TARGET_GAP, reference=None):
+    #the flat record of one parsed solve with the derived metrics
+    record = {name: value for name, value in solve.items() if name not in ('parameters', 'points', 'cuts')}
+    for name, value in solve['parameters'].items():
+        record['parameter_' + name] = number(value) if number(value) is not None else value
+    for name, count in solve['cuts'].items():
+        record['cuts_' + name] = count
+    record['cuts'] = sum(solve['cuts'].values())
+    if 'rows' in solve and 'presolved_rows' in solve:
+        record['presolve_row_reduction'] = 1 - solve['presolved_rows'] / max(solve['rows'], 1)
+        record['presolve_col_reduction'] = 1 - solve['presolved_cols'] / max(solve['cols'], 1)
+        record['presolve_nonzero_reduction'] = 1 - solve['presolved_nonzeros'] / max(solve['nonzeros'], 1)
+    points = solve['points']
+    seconds = solve.get('seconds')
+    record['time_to_gap'] = time_to_gap(points, target_gap, seconds, solve.get('gap'))
+    #linear programs have no incumbents to integrate
+    if not solve.get('relaxation'):
+        record['primal_integral'] = primal_integral(points, seconds, reference if reference is not None else solve.get('objective'))
+    incumbents = [point for point in points if point[1] is not None]
+    record['first_incumbent_seconds'] = incumbents[0][0] if incumbents else None
+    record['incumbents'] = len(incumbents)
+    return(record)
+
+
+def parse_settings(path):
+    #settings of a run: the json of sweep.run_point, or the notes of the results/ folders, where the
+    #'self.name = value' lines and the arguments of the constraint calls that are not commented out count
+    with open(path) as file:
+        text = file.read()
+    try:
+        return(json.loads(text))
+    except ValueError:
+        pass
+    settings = {}
+    constraints = []
+    for line in text.splitlines():
+        line = line.strip()
+        if line.startswith('#'):
+            continue
+        match = re.match(r'^self\.(\w+)\s*=\s*(\S+)$', line)
+        if match and number(match.group(2)) is not None:
+            settings.setdefault(match.group(1), number(match.group(2)))
+            continue
+        match = re.match(r'^self\.(constraint_\w+)\(([^)]*)\)', line)
+        if match:
+            name = match.group(1)
+            if name not in constraints:
+                constraints.append(name)
+            arguments = [number(argument) for argument in match.group(2).split(',') if argument.strip()]
+            if arguments and arguments[0] is not None:
+                settings.setdefault(name, arguments[0])
+    settings['constraints'] = ' '.join(sorted(constraints))
+    return(settings)
+
+
+def parse_result(path):
+    #summary of a result csv (expansion.frame): assignments, periods and the average recipe values
+    result_df = pd.read_csv(path, index_col=0)
+    summary = {'assignments': len(result_df)}
+    if 'period' in result_df:
+        summary['periods'] = int(result_df['period'].nunique())
+    if 'title' in result_df:
+        summary['recipes'] = int(result_df['title'].nunique())
+    for column in ('rating', 'profit', 'calories', 'protein', 'fat'):
+        if column in result_df:
+            summary['mean_' + column] = float(result_df[column].mean())
+    return(summary)
+
+
+class log_table():
+    #the solves of every run directory under root as one table, one row per solve (or per run without a
+    #Gurobi solve) with the run's settings and result summary; parsed files are kept in cache_path
+    #(json) by size and modification time, so a repeated parse only reads what changed
+    def __init__(self, root='results', cache_path=None, target_gap=TARGET_GAP):
+        self.root = root
+        self.cache_path = cache_path if cache_path is not None else os.path.join(root, '.solver_logs.json')
+        self.target_gap = target_gap
+        self.cache = {}
+        if os.path.exists(self.cache_path):
+            with open(self.cache_path) as file:
+                self.cache = json.load(file)
+            if self.cache.get('target_gap') != target_gap or self.cache.get('version') != PARSER_VERSION:
+                self.cache = {}
+        self.cache.update(target_gap=target_gap, version=PARSER_VERSION)
+        self.cache.setdefault('files', {})
+        self.parsed = 0
+
+    def cached(self, path, parse):
+        #parse(path), or its stored value while the file keeps its size and modification time
+        stat = os.stat(path)
+        stamp = [stat.st_size, stat.st_mtime_ns]
+        entry = self.cache['files'].get(path)
+        if entry is None or entry['stamp'] != stamp:
+            entry = {'stamp': stamp, 'value': parse(path)}
+            self.cache['files'][path] = entry
+            self.parsed += 1
+        return(entry['value'])
+
+    def parse_log(self, path):
+        with open(path, errors='replace') as file:
+            solves = parse_gurobi_log(file.read())
+        return([solve_metrics(solve, self.target_gap) for solve in solves])
+
+    def run_directories(self):
+        #directories under root with a solver log, settings or a result
+        directories = set()
+        for pattern in [LOG_PATTERN, RESULT_PATTERN] + list(SETTINGS_NAMES):
+            for path in glob.glob(os.path.join(self.root, '**', pattern), recursive=True):
+                if os.path.isfile(path):
+                    directories.add(os.path.dirname(path))
+        return(sorted(directories))
+
+    def run(self, directory):
+        #rows of one run directory
+        run = {'run': os.path.relpath(directory, self.root)}
+        for name in SETTINGS_NAMES:
+            path = os.path.join(directory, name)
+            if os.path.isfile(path):
+                run.update(('setting_' + key, value) for key, value in self.cached(path, parse_settings).items())
+                break
+        for path in sorted(glob.glob(os.path.join(directory, RESULT_PATTERN))):
+            if os.path.isfile(path) and not path.endswith('.json'):
+                run.update(('result_' + key, value) for key, value in self.cached(path, parse_result).items())
+                run['result_file'] = os.path.basename(path)
+                break
+        rows = []
+        for path in sorted(glob.glob(os.path.join(directory, LOG_PATTERN))):
+            for position, solve in enumerate(self.cached(path, self.parse_log)):
+                rows.append(dict(run, log=os.path.basename(path), solve=position, **solve))
+        return(rows or [run])
+
+    def table(self):
+        rows = []
+        for directory in self.run_directories():
+            rows += self.run(directory)
+        #files that are gone are dropped from the cache
+        seen = set(glob.glob(os.path.join(self.root, '**', '*'), recursive=True))
+        self.cache['files'] = {path: entry for path, entry in self.cache['files'].items() if path in seen}
+        with open(self.cache_path, 'w') as file:
+            json.dump(self.cache, file)
+        table = pd.DataFrame(rows)
+        front = [column for column in ('run', 'log', 'solve', 'status', 'threads', 'threads_used', 'seconds',
+                                       'objective', 'bound', 'gap', 'time_to_gap', 'primal_integral') if column in table]
+        return(table[front + [column for column in table if column not in front]])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='one table of the Gurobi logs, settings and results of run directories')
+    parser.add_argument('root', nargs='?', default='results')
+    parser.add_argument('--output', default='solver_logs.csv')
+    parser.add_argument('--cache', help='parse cache (default <root>/.solver_logs.json)')
+    parser.add_argument('--gap', type=float, default=TARGET_GAP, help='gap of the time_to_gap column')
+    parser.add_argument('--runs', nargs='*', help='print these runs side by side, e.g. 9-model3_set_lowcpu 16-model3_set')
+    args = parser.parse_args()
+    logs = log_table(args.root, args.cache, args.gap)
+    table = logs.table()
+    table.to_csv(args.output, index=False)
+    print('{} rows from {} runs, {} files parsed'.format(len(table), table['run'].nunique(), logs.parsed))
+    if args.runs:
+        selected = table[table['run'].isin(args.runs)].set_index(['run', 'solve'])
+        print(selected.T.to_string())
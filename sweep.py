@@ -0,0 +1,107 @@
+import argparse
+import itertools
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from model_setup import MODELS, load_model_class
+
+#parameters a sweep may vary, all of them are keyword arguments of the model classes
+SWEEP_PARAMETERS = ('period_number', 'n_assigned', 'r', 'deviation_percentage', 'repetition_interval',
+                    'target_calorie', 'target_protein', 'target_fat', 'target_rating', 'target_tags',
+                    'robust_formulation', 'lazy_rows', 'prune_dominated')
+
+
+def grid(**axes):
+    #every combination of the given parameter values, e.g. grid(n_assigned=[30, 60], r=[10, 15])
+    for name in axes:
+        if name not in SWEEP_PARAMETERS:
+            raise ValueError('{} is not a sweep parameter'.format(name))
+    names = list(axes)
+    return([dict(zip(names, values)) for values in itertools.product(*(axes[name] for name in names))])
+
+
+def point_name(model_name, parameters):
+    return(model_name + ''.join('_{}{}'.format(name, value) for name, value in sorted(parameters.items())))
+
+
+def run_point(model_name, parameters, directory, threads, max_seconds, data_path, cache_directory, solver='GRB'):
+    #solves one grid point inside its own directory, solver output goes to mip_log like the results/ folders
+    #the pool worker runs the next point afterwards, its working directory, stdout and stderr are restored
+    os.makedirs(directory, exist_ok=True)
+    cwd = os.getcwd()
+    sys.stdout.flush()
+    sys.stderr.flush()
+    saved = (os.dup(1), os.dup(2))
+    log = os.open(os.path.join(directory, 'mip_log'), os.O_WRONLY | os.O_CREAT | os.O_TRUNC)
+    try:
+        os.chdir(directory)
+        settings = dict(parameters, model=model_name, solver=solver, threads=threads, max_seconds=max_seconds)
+        with open('settings', 'w') as file:
+            json.dump(settings, file, indent=1)
+        os.dup2(log, 1)
+        os.dup2(log, 2)
+        start = time.time()
+        model_class = load_model_class(model_name)
+        model = model_class(data_path=data_path, cache_directory=cache_directory, solver=solver, threads=threads,
+                            max_seconds=max_seconds, **parameters)
+        summary = dict(settings, directory=directory, seconds=time.time() - start, **model.result.summary())
+        with open('summary.json', 'w') as file:
+            json.dump(summary, file, indent=1)
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os.dup2(saved[0], 1)
+        os.dup2(saved[1], 2)
+        for fd in saved + (log,):
+            os.close(fd)
+        os.chdir(cwd)
+    return(summary)
+
+
+def run_sweep(model_name, points, jobs=1, threads=1, max_seconds=7200, output_directory='sweep',
+              data_path='cleaned_db.csv', cache_directory='model_cache', solver='GRB'):
+    #solves the points in a pool of jobs processes, every solve is capped at threads threads
+    #(at least one: 0 and -1 leave the count to the solver and would get around the core limit)
+    if threads < 1:
+        raise ValueError('threads must be at least 1, not {}'.format(threads))
+    if jobs * threads > os.cpu_count():
+        raise ValueError('{} jobs x {} threads exceed the {} available cores'.format(jobs, threads, os.cpu_count()))
+    data_path = os.path.abspath(data_path)
+    cache_directory = os.path.abspath(cache_directory)
+    output_directory = os.path.abspath(output_directory)
+    os.makedirs(output_directory, exist_ok=True)
+    summaries = []
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = {pool.submit(run_point, model_name, parameters,
+                               os.path.join(output_directory, point_name(model_name, parameters)),
+                               threads, max_seconds, data_path, cache_directory, solver): parameters
+                   for parameters in points}
+        for future in as_completed(futures):
+            try:
+                summary = future.result()
+            except Exception as error:
+                summary = dict(futures[future], model=model_name, status='ERROR', error=repr(error))
+            print(json.dumps(summary))
+            summaries.append(summary)
+    with open(os.path.join(output_directory, 'sweep.json'), 'w') as file:
+        json.dump(summaries, file, indent=1)
+    return(summaries)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='parallel parameter sweep over one of the models')
+    parser.add_argument('model', choices=sorted(MODELS))
+    parser.add_argument('grid', help='json object of parameter lists, e.g. \'{"n_assigned": [30, 60], "r": [10, 15]}\'')
+    parser.add_argument('--solver', default='GRB', help='GRB, CBC or HIGHS')
+    parser.add_argument('--jobs', type=int, default=1)
+    parser.add_argument('--threads', type=int, default=1, help='threads per solve')
+    parser.add_argument('--max-seconds', type=float, default=7200)
+    parser.add_argument('--output', default='sweep')
+    parser.add_argument('--data', default='cleaned_db.csv')
+    parser.add_argument('--cache', default='model_cache')
+    args = parser.parse_args()
+    run_sweep(args.model, grid(**json.loads(args.grid)), args.jobs, args.threads, args.max_seconds,
+              args.output, args.data, args.cache, args.solver)
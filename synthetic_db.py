@@ -0,0 +1,104 @@
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+from scipy.stats import norm
+from recipe_store import file_hash
+
+NUMERIC_COLUMNS = ['rating', 'calories', 'protein', 'fat', 'profit']
+INTEGER_COLUMNS = ['calories', 'protein', 'fat']
+
+
+class synthetic_db():
+    #fits the recipe table once and samples statistically similar tables of any size
+    #numeric columns: gaussian copula, i.e. the empirical marginals joined by the correlation of their normal scores
+    #tags: number of tags per recipe and tag frequencies of the source, tags drawn by frequency
+    def __init__(self, recipes_df):
+        self.recipes_df = recipes_df
+        n = len(recipes_df)
+        self.marginals = {column: np.sort(recipes_df[column].to_numpy(dtype=float)) for column in NUMERIC_COLUMNS}
+        ranks = recipes_df[NUMERIC_COLUMNS].rank(method='average').to_numpy()
+        scores = norm.ppf(ranks / (n + 1))
+        self.correlation = np.corrcoef(scores, rowvar=False)
+        tokens = [[item for item in tags.split(',') if item != ''] for tags in recipes_df['tags']]
+        self.tag_counts = np.array([len(items) for items in tokens])
+        frequency = pd.Series([item for items in tokens for item in items]).value_counts()
+        self.vocabulary = frequency.index.to_numpy()
+        self.tag_probability = frequency.to_numpy() / frequency.sum()
+        self.titles = recipes_df['title'].str.strip().to_numpy()
+
+    def numeric(self, n_recipes, rng):
+        scores = rng.multivariate_normal(np.zeros(len(NUMERIC_COLUMNS)), self.correlation, size=n_recipes)
+        quantiles = norm.cdf(scores)
+        columns = {}
+        for index_c, column in enumerate(NUMERIC_COLUMNS):
+            marginal = self.marginals[column]
+            values = np.interp(quantiles[:, index_c] * (len(marginal) - 1), np.arange(len(marginal)), marginal)
+            columns[column] = np.rint(values).astype(np.int64) if column in INTEGER_COLUMNS else np.round(values, 2)
+        return(columns)
+
+    def tags(self, n_recipes, rng):
+        counts = rng.choice(self.tag_counts, size=n_recipes)
+        drawn = rng.choice(len(self.vocabulary), size=counts.sum(), p=self.tag_probability)
+        bounds = np.concatenate([[0], np.cumsum(counts)])
+        #duplicates drawn for the same recipe are dropped, so frequent tags are slightly under-represented
+        return([','.join(self.vocabulary[np.unique(drawn[bounds[row]:bounds[row + 1]])]) for row in range(n_recipes)])
+
+    def sample(self, n_recipes, seed=0):
+        rng = np.random.default_rng(seed)
+        columns = self.numeric(n_recipes, rng)
+        titles = self.titles[rng.integers(len(self.titles), size=n_recipes)]
+        ix = np.arange(n_recipes)
+        recipes_df = pd.DataFrame({'ix': ix,
+                                   'title': [title + ' #' + str(index) for title, index in zip(titles, ix)],
+                                   'rating': columns['rating'],
+                                   'calories': columns['calories'],
+                                   'protein': columns['protein'],
+                                   'fat': columns['fat'],
+                                   'tags': self.tags(n_recipes, rng),
+                                   'profit': columns['profit']})
+        return(recipes_df)
+
+    def compare(self, recipes_df):
+        #per column quantiles of the source and of a sample, plus the largest difference of rank correlations
+        quantiles = [0.05, 0.25, 0.5, 0.75, 0.95]
+        rows = []
+        for column in NUMERIC_COLUMNS:
+            rows.append([column, 'source'] + list(self.recipes_df[column].quantile(quantiles)))
+            rows.append([column, 'sample'] + list(recipes_df[column].quantile(quantiles)))
+        summary = pd.DataFrame(rows, columns=['column', 'table'] + ['q' + str(q) for q in quantiles])
+        correlation_error = np.abs(self.recipes_df[NUMERIC_COLUMNS].corr(method='spearman').to_numpy()
+                                   - recipes_df[NUMERIC_COLUMNS].corr(method='spearman').to_numpy()).max()
+        return(summary, correlation_error)
+
+
+def sample_path(directory, n_recipes, seed, source):
+    #file of a sample, named after the content of its source so a sample of an edited source is a new file
+    return(os.path.join(directory, 'recipes_{}_seed{}_{}.csv'.format(n_recipes, seed, file_hash(source)[:16])))
+
+
+def instance(n_recipes, period_number=12, seed=0, source='cleaned_db.csv', directory='synthetic'):
+    #writes a synthetic recipe table and returns the keyword arguments that point a model class at it
+    os.makedirs(directory, exist_ok=True)
+    data_path = sample_path(directory, n_recipes, seed, source)
+    if not os.path.exists(data_path):
+        synthetic_db(pd.read_csv(source)).sample(n_recipes, seed).to_csv(data_path, index=False)
+    return({'data_path': data_path, 'period_number': period_number})
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='synthetic recipe tables for scaling benchmarks')
+    parser.add_argument('sizes', type=int, nargs='+', help='numbers of recipes, e.g. 10000 100000 1000000')
+    parser.add_argument('--source', default='cleaned_db.csv')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='synthetic')
+    args = parser.parse_args()
+    generator = synthetic_db(pd.read_csv(args.source))
+    os.makedirs(args.output, exist_ok=True)
+    for n_recipes in args.sizes:
+        recipes_df = generator.sample(n_recipes, args.seed)
+        recipes_df.to_csv(sample_path(args.output, n_recipes, args.seed, args.source), index=False)
+        summary, correlation_error = generator.compare(recipes_df)
+        print(n_recipes, 'recipes, largest rank correlation difference {:.3f}'.format(correlation_error))
+        print(summary.to_string(index=False))
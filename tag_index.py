@@ -0,0 +1,222 @@
+import copy
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+TAG_MODES = ('substring', 'token', 'normalized')
+
+
+def tag_tokens(tags):
+    #(vocabulary, indptr, indices): the comma separated tokens of every recipe's tags string as token ids,
+    #recipe k has indices[indptr[k]:indptr[k + 1]], vocabulary in order of first appearance like tag_index
+    #every distinct tags string is split once, recipes sharing one share its token ids; the strings are split
+    #and their tokens interned in one pass each (a single split of all of them joined, pd.factorize), not per string
+    #a missing tags string (NaN) has no tokens
+    codes, uniques = pd.factorize(np.asarray(tags, dtype=object))
+    uniques = [str(text) for text in uniques]
+    if (codes < 0).any():
+        codes = np.where(codes < 0, len(uniques), codes)
+        uniques.append('')
+    token_codes, vocabulary = pd.factorize(np.asarray(','.join(uniques).split(',') if uniques else [], dtype=object))
+    owner = np.repeat(np.arange(len(uniques)), [text.count(',') + 1 for text in uniques])
+    #empty tokens (trailing commas) are no tokens, and a token counts once per string
+    empty = np.flatnonzero(vocabulary == '')
+    if len(empty):
+        keep = token_codes != empty[0]
+        owner = owner[keep]
+        token_codes = token_codes[keep] - (token_codes[keep] > empty[0])
+        vocabulary = np.delete(vocabulary, empty[0])
+    pairs = np.sort(owner.astype(np.int64) * max(1, len(vocabulary)) + token_codes)
+    pairs = pairs[np.concatenate([[True], pairs[1:] != pairs[:-1]])] if len(pairs) else pairs
+    flat = (pairs % max(1, len(vocabulary))).astype(np.int32)
+    lengths = np.bincount(pairs // max(1, len(vocabulary)), minlength=len(uniques))
+    starts = np.concatenate([[0], np.cumsum(lengths)[:-1]]).astype(np.int64)
+    indptr = np.zeros(len(codes) + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum(lengths[codes])
+    positions = np.repeat(starts[codes] - indptr[:-1], lengths[codes]) + np.arange(indptr[-1])
+    return(list(vocabulary), indptr, flat[positions])
+
+
+def segment(token, vocabulary, ordered=True, previous=''):
+    #fewest tags of vocabulary that token is the concatenation of, None if there are none
+    #ordered: the tags must follow each other (and previous) in sorted order; the fused tokens of cleaned_db.csv are
+    #neighbours of a sorted tag list that lost their comma, so 'sautésoy free' is 'sauté' + 'soy free' but 'peanut' never 'pea' + 'nut'
+    memo = {}
+
+    def rest(start, previous):
+        #fewest tags spelling token[start:], none of them sorting before previous
+        if start == len(token):
+            return([])
+        if (start, previous) not in memo:
+            best = None
+            for end in range(len(token), start, -1):
+                piece = token[start:end]
+                if piece in vocabulary and not (ordered and piece < previous):
+                    tail = rest(end, piece)
+                    if tail is not None and (best is None or len(tail) + 1 < len(best)):
+                        best = [piece] + tail
+            memo[start, previous] = best
+        return(memo[start, previous])
+    return(rest(0, previous))
+
+
+def learn_vocabulary(tokens, ordered=True):
+    #(tags, splits) of the distinct comma separated tokens: a token is a tag unless it is the concatenation of
+    #shorter tags, splits maps every such fused token to its tags; shorter tokens are decided first
+    #only tokens that occur on their own are tags, a fused token is never split around a piece that does not:
+    #guessing such pieces split 'poultry sausage' into 'poultry sau' + 'sage' and 'breadcrumbs' into 'bread' + 'crumbs',
+    #so a fused token with an unknown piece ('low carbmarinatesummertequilatomato') stays a tag of its own
+    tags = set()
+    splits = {}
+    for token in sorted(set(tokens), key=len):
+        pieces = segment(token, tags, ordered)
+        if pieces is None:
+            tags.add(token)
+        else:
+            splits[token] = pieces
+    return(tags, splits)
+
+
+def tag_bits(matrix):
+    #(recipe x word) uint64 bitsets of a recipe x tag incidence matrix, tag t is bit t % 64 of word t // 64
+    incidence = matrix.tocoo()
+    bits = np.zeros((matrix.shape[0], max(1, -(-matrix.shape[1] // 64))), dtype=np.uint64)
+    np.bitwise_or.at(bits, (incidence.row, incidence.col // 64), np.left_shift(np.uint64(1), (incidence.col % 64).astype(np.uint64)))
+    return(bits)
+
+
+class tag_index():
+    #recipe x tag incidence matrix built once from the recipe table (one row per recipe, not per period)
+    #mode 'substring': a recipe has a tag if the tag occurs anywhere in its tags string, so 'pea' matches 'peanut free';
+    #what constraint_7..9 always did, kept to reproduce old results
+    #mode 'token' (the default): a recipe has a tag if the tag is one of its comma separated tokens
+    #mode 'normalized': fused tokens ('gourmetonion') are split into the tags they are made of (see learn_vocabulary),
+    #a recipe has a tag if one of its tokens is the tag or splits into it, so 'pea' no longer matches 'peanut free'
+    #every mode also keeps the rows as bitsets (bits) for the any_of, all_of and none_of queries the constraints share
+    def __init__(self, recipes_df, mode='token', tokens=None):
+        #tokens: (vocabulary, indptr, indices) of the tags of recipes_df as stored by recipe_store (load_recipes with
+        #tokens=True), the tags strings are split here when they are not given
+        if mode not in TAG_MODES:
+            raise ValueError('unknown tag matching mode {}'.format(mode))
+        self.mode = mode
+        self.recipe_ids = recipes_df['ix'].to_numpy()
+        if tokens is None:
+            tokens = tag_tokens(recipes_df['tags'].tolist())
+        vocabulary, indptr, indices = tokens
+        #(recipe x token) incidence, vocabulary in order of first appearance
+        recipe_tokens = sp.csr_matrix((np.ones(len(indices)), np.asarray(indices), np.asarray(indptr)),
+                                      shape=(len(self.recipe_ids), len(vocabulary)))
+        self.splits = {}
+        if mode == 'normalized':
+            self.matrix = self.normalized(vocabulary, recipe_tokens)
+        else:
+            self.matrix = self.raw(vocabulary, recipe_tokens, mode)
+        self.tag_ids = {tag: index_t for index_t, tag in enumerate(self.vocabulary)}
+        self.matrix.sort_indices()
+        self.bits = tag_bits(self.matrix)
+
+    def raw(self, vocabulary, recipe_tokens, mode):
+        #incidence of the comma separated tokens themselves, matched as tokens or as substrings
+        self.vocabulary = list(vocabulary)
+        if mode == 'token':
+            return(recipe_tokens)
+        #a tag has no comma, so it occurs in a tags string exactly when it occurs in one of its tokens:
+        #the (token x tag) containment is found once over the distinct tokens, not per recipe, by scanning
+        #all tokens joined into one string and jumping to the next token after each match
+        joined = '\n'.join(self.vocabulary) + '\n'
+        lengths = [len(token) + 1 for token in self.vocabulary]
+        owner = np.repeat(np.arange(len(self.vocabulary)), lengths).tolist()
+        ends = np.cumsum(lengths).tolist()
+        found_tokens = []
+        for tag in self.vocabulary:
+            found = []
+            start = joined.find(tag)
+            while start >= 0:
+                index_s = owner[start]
+                found.append(index_s)
+                start = joined.find(tag, ends[index_s])
+            found_tokens.append(found)
+        rows = np.fromiter((index_s for found in found_tokens for index_s in found), dtype=np.int64)
+        cols = np.repeat(np.arange(len(self.vocabulary)), [len(found) for found in found_tokens])
+        token_tags = sp.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(len(self.vocabulary), len(self.vocabulary)))
+        matrix = (recipe_tokens @ token_tags).tocsr()
+        #a tag contained in two tokens of one recipe still counts once
+        matrix.data[:] = 1.0
+        return(matrix)
+
+    def normalized(self, tokens, recipe_tokens):
+        #(recipe x token) incidence times the (token x tag) map of learn_vocabulary, every distinct token split once
+        self.splits = learn_vocabulary(tokens)[1]
+        pieces = [self.splits.get(token, [token]) for token in tokens]
+        #vocabulary in order of first appearance of the tokens
+        self.vocabulary = list(dict.fromkeys(tag for items in pieces for tag in items))
+        tag_ids = {tag: index_t for index_t, tag in enumerate(self.vocabulary)}
+        token_rows = np.repeat(np.arange(len(tokens)), [len(items) for items in pieces])
+        token_cols = np.fromiter((tag_ids[tag] for items in pieces for tag in items), dtype=np.int64, count=len(token_rows))
+        token_tags = sp.csr_matrix((np.ones(len(token_rows)), (token_rows, token_cols)), shape=(len(tokens), len(self.vocabulary)))
+        matrix = (recipe_tokens @ token_tags).tocsr()
+        #a tag reached through two tokens of one recipe still counts once
+        matrix.data[:] = 1.0
+        return(matrix)
+
+    @property
+    def counts(self):
+        #number of recipes matching each tag
+        return(pd.Series(np.asarray(self.matrix.sum(axis=0)).ravel().astype(int), index=self.vocabulary, name='recipes'))
+
+    def recipes_with(self, tag):
+        #boolean mask over the recipes matching tag
+        return(self.matrix[:, self.tag_ids[tag]].toarray().ravel() > 0)
+
+    def tags_of(self, recipe):
+        #tags matched by the recipe with ix == recipe
+        position = np.flatnonzero(self.recipe_ids == recipe)[0]
+        return([self.vocabulary[index_t] for index_t in self.matrix[position].indices])
+
+    def summary(self):
+        return(pd.DataFrame({'tag': self.vocabulary, 'recipes': self.counts.to_numpy()}))
+
+    def rows(self, recipe_ids):
+        #positions of the recipes with these ix in the index
+        return(pd.Index(self.recipe_ids).get_indexer(recipe_ids))
+
+    def subset(self, recipe_ids):
+        #the index of some of the recipes with the same vocabulary (which stays the one learned from all recipes)
+        index = copy.copy(self)
+        positions = self.rows(recipe_ids)
+        index.recipe_ids = self.recipe_ids[positions]
+        index.matrix = self.matrix[positions]
+        index.bits = self.bits[positions]
+        return(index)
+
+    def mask(self, tags):
+        #one bitset word row with the bits of tags set, tags outside the vocabulary set none
+        if isinstance(tags, str):
+            tags = [tags]
+        mask = np.zeros(self.bits.shape[1], dtype=np.uint64)
+        for tag in tags:
+            if tag in self.tag_ids:
+                index_t = self.tag_ids[tag]
+                mask[index_t // 64] |= np.left_shift(np.uint64(1), np.uint64(index_t % 64))
+        return(mask)
+
+    def any_of(self, tags):
+        #boolean mask over the recipes matching at least one of tags (a tag or a list of them)
+        mask = self.mask(tags)
+        words = np.flatnonzero(mask)
+        return((self.bits[:, words] & mask[words] != 0).any(axis=1))
+
+    def all_of(self, tags):
+        #boolean mask over the recipes matching every one of tags, none when one is outside the vocabulary
+        if isinstance(tags, str):
+            tags = [tags]
+        if any(tag not in self.tag_ids for tag in tags):
+            return(np.zeros(len(self.recipe_ids), dtype=bool))
+        mask = self.mask(tags)
+        words = np.flatnonzero(mask)
+        return((self.bits[:, words] & mask[words] == mask[words]).all(axis=1))
+
+    def none_of(self, tags):
+        #boolean mask over the recipes matching none of tags
+        return(~self.any_of(tags))